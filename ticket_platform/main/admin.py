@@ -1,4 +1,237 @@
-from django.contrib import admin
-from .models import Event
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-admin.site.register(Event)
+from .fragment_cache import bump_inventory_version
+from .lottery import get_pending_lottery_events
+from .models import Event, Order, Ticket, PlatformTotals
+from .rollup import record_sale
+from .sharding import get_shards, get_ticket_databases
+from .totals import estimate_row_count
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which doesn't count whole table. Number of rows of unfiltered changelist is taken from planner
+    statistics when table is bigger than 'ADMIN_EXACT_COUNT_LIMIT' rows, filtered changelists are counted as usual.
+    """
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimate_row_count(self.object_list.model)
+            if estimate is not None and estimate > getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000):
+                return estimate
+        return super().count
+
+
+def count_tickets(relation, **filters):
+    """
+    Correlated subquery counting tickets of event or order, evaluated only for rows shown on changelist page instead
+    of grouping whole table.
+    :param relation: name of Ticket field pointing to counted object ('event' or 'order').
+    :param filters: additional filters of counted tickets.
+    """
+    return Coalesce(Subquery(
+        Ticket.objects.filter(**{relation: OuterRef('pk')}, **filters).order_by().values(relation).annotate(
+            count=Count('id')
+        ).values('count'),
+        output_field=IntegerField(),
+    ), Value(0))
+
+
+def count_tickets_on_shards(relation, object_ids, **filters) -> dict:
+    """
+    Count tickets of given events or orders with one grouped query per ticket database. Used instead of
+    'count_tickets' subquery when inventory is sharded, as catalog rows and tickets live on different databases.
+    :param relation: name of Ticket field pointing to counted object ('event' or 'order').
+    :param object_ids: ids of counted objects.
+    :param filters: additional filters of counted tickets.
+    :return: dictionary with object id: number of tickets.
+    """
+    counts = {}
+    for database in get_ticket_databases():
+        for object_id, count in Ticket.objects.using(database).filter(
+            **{f'{relation}_id__in': object_ids}, **filters
+        ).order_by().values_list(relation).annotate(Count('id')):
+            counts[object_id] = counts.get(object_id, 0) + count
+    return counts
+
+
+class TicketCountChangeList(ChangeList):
+    """
+    Changelist which counts tickets of rows shown on page after page is taken, when inventory is sharded.
+    """
+    def get_results(self, request):
+        super().get_results(request)
+        if get_shards():
+            self.model_admin.count_page_tickets(self.result_list)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    Admin for big tables. Ticket counts listed in 'get_ticket_counts' are annotated with subqueries, or counted
+    shard by shard for rows of current page when inventory is sharded (they couldn't be sorted then).
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ticket_relation = None
+
+    def get_ticket_counts(self) -> dict:
+        """
+        :return: dictionary with name of annotation: filters of counted tickets.
+        """
+        return {}
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if get_shards():
+            return queryset
+        return queryset.annotate(**{
+            name: count_tickets(self.ticket_relation, **filters) for name, filters in self.get_ticket_counts().items()
+        })
+
+    def get_changelist(self, request, **kwargs):
+        return TicketCountChangeList
+
+    def get_sortable_by(self, request):
+        sortable_by = super().get_sortable_by(request)
+        if get_shards():
+            return [name for name in sortable_by if name not in self.get_ticket_counts()]
+        return sortable_by
+
+    def count_page_tickets(self, objects) -> None:
+        object_ids = [obj.pk for obj in objects]
+        for name, filters in self.get_ticket_counts().items():
+            counts = count_tickets_on_shards(self.ticket_relation, object_ids, **filters)
+            for obj in objects:
+                setattr(obj, name, counts.get(obj.pk, 0))
+
+
+@admin.register(Event)
+class EventAdmin(ScalableAdmin):
+    list_display = ('name', 'time_and_date', 'reservations', 'available_tickets', 'sold_tickets', 'is_archived')
+    list_filter = ('is_archived',)
+    search_fields = ('^name',)
+    ordering = ('-time_and_date',)
+    actions = ('reprice',)
+    ticket_relation = 'event'
+
+    def get_ticket_counts(self) -> dict:
+        return {
+            'available_tickets': {'is_sold': False, 'reservation_time__lt': timezone.now()},
+            'sold_tickets': {'is_sold': True},
+        }
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if get_shards():
+            # Repricing engine reads tickets from single database.
+            actions.pop('reprice', None)
+        return actions
+
+    @admin.display(ordering='available_tickets')
+    def available_tickets(self, event) -> int:
+        return event.available_tickets
+
+    @admin.display(ordering='sold_tickets')
+    def sold_tickets(self, event) -> int:
+        return event.sold_tickets
+
+    @admin.action(description="Reprice unsold tickets of selected events")
+    def reprice(self, request, queryset):
+        # Repricing engine needs NumPy, which is heavy, so it is imported only when action is run.
+        from .repricing import RepricingEngine
+
+        engine = RepricingEngine()
+        engine.load(list(queryset.values_list('id', flat=True)))
+        updated = engine.apply(engine.compute())
+        self.message_user(request, f"{updated} tickets repriced.")
+
+
+@admin.register(Ticket)
+class TicketAdmin(ScalableAdmin):
+    list_display = ('id', 'event', 'category', 'price', 'is_sold', 'reservation_time', 'order')
+    list_select_related = ('event', 'order')
+    list_filter = ('is_sold', 'category')
+    search_fields = ('=id', '=event__id', '=order__id')
+    raw_id_fields = ('event', 'order', 'seat')
+    ordering = ('-id',)
+    actions = ('release_holds', 'mark_sold')
+
+    # Tickets of sharded inventory are spread among many databases, so they couldn't be listed by single
+    # changelist. Tickets are available only through events then.
+    def has_module_permission(self, request):
+        return not get_shards() and super().has_module_permission(request)
+
+    def has_view_permission(self, request, obj=None):
+        return not get_shards() and super().has_view_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        return not get_shards() and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return not get_shards() and super().has_delete_permission(request, obj)
+
+    @admin.action(description="Release holds of selected tickets")
+    def release_holds(self, request, queryset):
+        now = timezone.now()
+        held = queryset.filter(is_sold=False, reservation_time__gt=now)
+        event_ids = set(held.values_list('event_id', flat=True))
+        released = held.update(reservation_time=now)
+        for event_id in event_ids:
+            bump_inventory_version(event_id)
+        self.message_user(request, f"{released} holds released.")
+
+    @admin.action(description="Mark selected tickets as sold")
+    def mark_sold(self, request, queryset):
+        """
+        Sell selected tickets, which are neither sold nor held, within single order of admin user. Nothing is sold
+        if any ticket belongs to event with pending lottery.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            ticket_ids = list(queryset.filter(
+                is_sold=False, reservation_time__lte=now
+            ).select_for_update().values_list('id', flat=True))
+            if not ticket_ids:
+                self.message_user(request, "No available tickets selected.", messages.WARNING)
+                return
+            pending = get_pending_lottery_events(
+                Ticket.objects.filter(id__in=ticket_ids).values_list('event_id', flat=True).distinct()
+            )
+            if pending:
+                self.message_user(
+                    request, f"Tickets of events with ids {pending} are allocated by lottery.", messages.ERROR
+                )
+                return
+            order = Order.objects.create(name=request.user.get_username(), surname="admin")
+            tickets = Ticket.objects.filter(id__in=ticket_ids)
+            sold = tickets.update(is_sold=True, order=order, reservation_time=now)
+            record_sale(order, tickets.only('category', 'price'))
+            PlatformTotals.add(sold_tickets=sold, profit=tickets.aggregate(Sum('price', default=0))['price__sum'])
+            event_ids = set(tickets.values_list('event_id', flat=True))
+        for event_id in event_ids:
+            bump_inventory_version(event_id)
+        self.message_user(request, f"{sold} tickets sold within order {order.id}.")
+
+
+@admin.register(Order)
+class OrderAdmin(ScalableAdmin):
+    list_display = ('id', 'name', 'surname', 'time_and_date', 'tickets')
+    search_fields = ('=id', '^surname')
+    ordering = ('-id',)
+    ticket_relation = 'order'
+
+    def get_ticket_counts(self) -> dict:
+        return {'tickets': {}}
+
+    @admin.display(ordering='tickets')
+    def tickets(self, order) -> int:
+        return order.tickets
@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Event, Ticket, Order, ArchivedTicket, ArchivedOrder, EventArchiveSummary, PlatformTotals
+from .sharding import get_ticket_databases, shard_for_event
+
+
+def get_events_to_archive(days):
+    """
+    Get events, which took place more than given number of days ago and weren't archived yet.
+    :param days: age of event in days.
+    :return: QuerySet with Event objects.
+    """
+    cutoff = timezone.now() - timezone.timedelta(days=days)
+    return Event.objects.filter(time_and_date__lt=cutoff, is_archived=False).order_by('time_and_date')
+
+
+def archive_event(event, batch_size=1000, using='default') -> int:
+    """
+    Move all tickets of event to archive, in batches. Each batch is moved in one transaction together with update of
+    event archive summary, so stats always see every ticket exactly once. Orders are moved when they have no
+    tickets left in main table.
+    :param event: Event object to archive.
+    :param batch_size: number of tickets moved in one transaction.
+    :param using: alias of database with archive tables.
+    :return: number of moved tickets.
+    """
+    summary, _ = EventArchiveSummary.objects.get_or_create(event=event)
+    database = shard_for_event(event.id)
+    moved = 0
+    while True:
+        tickets = list(Ticket.objects.using(database).filter(event=event).order_by('id')[:batch_size])
+        if not tickets:
+            break
+        sold_tickets = [ticket for ticket in tickets if ticket.is_sold]
+        with transaction.atomic(using=using), transaction.atomic(), transaction.atomic(using=database):
+            ArchivedTicket.objects.using(using).bulk_create([
+                ArchivedTicket(
+                    id=ticket.id,
+                    event_id=ticket.event_id,
+                    order_id=ticket.order_id,
+                    category=ticket.category,
+                    is_sold=ticket.is_sold,
+                    price=ticket.price,
+                ) for ticket in tickets
+            ], ignore_conflicts=True)
+            Ticket.objects.using(database).filter(id__in=[ticket.id for ticket in tickets]).delete()
+            EventArchiveSummary.objects.filter(pk=summary.pk).update(
+                total_tickets=F('total_tickets') + len(tickets),
+                sold_tickets=F('sold_tickets') + len(sold_tickets),
+                profit=F('profit') + sum(ticket.price for ticket in sold_tickets),
+                possible_profit=F('possible_profit') + sum(ticket.price for ticket in tickets),
+            )
+            _archive_orders({ticket.order_id for ticket in tickets if ticket.order_id}, using)
+            PlatformTotals.add(archived_tickets=len(tickets))
+        moved += len(tickets)
+    Event.objects.filter(pk=event.pk).update(is_archived=True)
+    return moved
+
+
+def _archive_orders(order_ids, using) -> None:
+    """
+    Move orders with given ids to archive, if they have no tickets left in main table on any shard.
+    """
+    for database in get_ticket_databases():
+        order_ids -= set(
+            Ticket.objects.using(database).filter(order_id__in=order_ids).values_list('order_id', flat=True)
+        )
+    orders = list(Order.objects.filter(id__in=order_ids))
+    ArchivedOrder.objects.using(using).bulk_create([
+        ArchivedOrder(
+            id=order.id,
+            name=order.name,
+            surname=order.surname,
+            time_and_date=order.time_and_date,
+        ) for order in orders
+    ], ignore_conflicts=True)
+    Order.objects.filter(id__in=[order.id for order in orders]).delete()
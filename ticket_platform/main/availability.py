@@ -0,0 +1,163 @@
+"""
+Availability snapshot shared by all workers on host.
+
+Number of available tickets per event and category is kept in memory-mapped file given by
+'AVAILABILITY_SNAPSHOT_PATH' setting. File is written every 'AVAILABILITY_SNAPSHOT_INTERVAL' seconds by single
+'refresh_availability' process, every worker maps it and reads counters without any lock or database query.
+Refresher writes every snapshot into new file and atomically replaces the old one, so readers always see complete
+snapshot. Snapshot older than 'AVAILABILITY_SNAPSHOT_MAX_AGE' seconds (or missing event) is ignored and
+availability is counted by database.
+
+File layout: header (magic, number of categories, number of events, unix time of snapshot), sorted event ids
+(int64) and counters (int32, one row per event, columns in order of Ticket.CATEGORY).
+"""
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from .sharding import get_ticket_databases
+
+HEADER = np.dtype([('magic', 'S4'), ('categories', '<u4'), ('events', '<u8'), ('updated_at', '<f8')])
+MAGIC = b'AVL1'
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot_path():
+    return getattr(settings, 'AVAILABILITY_SNAPSHOT_PATH', None)
+
+
+def get_snapshot_max_age() -> float:
+    return getattr(settings, 'AVAILABILITY_SNAPSHOT_MAX_AGE', 2.0)
+
+
+def get_snapshot_interval() -> float:
+    return getattr(settings, 'AVAILABILITY_SNAPSHOT_INTERVAL', 0.5)
+
+
+class AvailabilitySnapshot:
+    """
+    Read-only view of single snapshot file.
+    """
+    def __init__(self, path) -> None:
+        with open(path, 'rb') as snapshot_file:
+            self.inode = os.fstat(snapshot_file.fileno()).st_ino
+            self.buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self.buffer, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError(f"{path} is not availability snapshot.")
+        self.updated_at = float(header['updated_at'])
+        events, categories = int(header['events']), int(header['categories'])
+        self.event_ids = np.frombuffer(self.buffer, dtype='<i8', count=events, offset=HEADER.itemsize)
+        self.counts = np.frombuffer(
+            self.buffer, dtype='<i4', count=events * categories, offset=HEADER.itemsize + 8 * events
+        ).reshape(events, categories)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.updated_at
+
+    def get(self, event_id):
+        """
+        Get available tickets of event.
+        :return: tuple with number of available tickets per category, None if event is not in snapshot.
+        """
+        position = np.searchsorted(self.event_ids, event_id)
+        if position >= len(self.event_ids) or self.event_ids[position] != event_id:
+            return None
+        return tuple(int(count) for count in self.counts[position])
+
+
+def get_snapshot():
+    """
+    Get snapshot mapped by this process. When mapped snapshot gets older than refresh interval, file is checked
+    and mapped again if refresher replaced it.
+    :return: AvailabilitySnapshot object or None if snapshot is disabled, missing or stale.
+    """
+    global _snapshot
+    path = get_snapshot_path()
+    if not path:
+        return None
+    snapshot = _snapshot
+    if snapshot is None or snapshot.age > get_snapshot_interval():
+        with _snapshot_lock:
+            try:
+                if _snapshot is None or os.stat(path).st_ino != _snapshot.inode:
+                    _snapshot = AvailabilitySnapshot(path)
+            except (OSError, ValueError):
+                _snapshot = None
+            snapshot = _snapshot
+    if snapshot is None or snapshot.age > get_snapshot_max_age():
+        return None
+    return snapshot
+
+
+def get_available_counts(event_id):
+    """
+    Get available tickets of event from snapshot.
+    :return: tuple with number of available tickets per category or None if database has to be asked.
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    return snapshot.get(event_id)
+
+
+def collect_availability() -> tuple:
+    """
+    Count available tickets of all future events per category, with one grouped query per ticket database.
+    :return: tuple with sorted array of event ids and array of counters.
+    """
+    from .models import Event, Ticket
+
+    now = timezone.now()
+    event_ids = np.array(
+        Event.objects.filter(time_and_date__gt=now).order_by('id').values_list('id', flat=True), dtype='<i8'
+    )
+    categories = {code: index for index, (code, _) in enumerate(Ticket.CATEGORY)}
+    counts = np.zeros((len(event_ids), len(categories)), dtype='<i4')
+    for database in get_ticket_databases():
+        rows = Ticket.objects.using(database).filter(
+            is_sold=False, reservation_time__lt=now
+        ).values_list('event_id', 'category').annotate(Count('id')).order_by()
+        for event_id, category, count in rows:
+            position = np.searchsorted(event_ids, event_id)
+            if position < len(event_ids) and event_ids[position] == event_id:
+                counts[position, categories[category]] = count
+    return event_ids, counts
+
+
+def write_snapshot(path, event_ids, counts, updated_at=None) -> None:
+    """
+    Write snapshot into new file and replace old one, so readers never see partially written snapshot.
+    :param path: path of snapshot file.
+    :param event_ids: sorted array of event ids.
+    :param counts: array with one row of counters per event.
+    :param updated_at: unix time of snapshot, current time by default.
+    """
+    header = np.array(
+        [(MAGIC, counts.shape[1], len(event_ids), time.time() if updated_at is None else updated_at)], dtype=HEADER
+    )
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(header.tobytes())
+        snapshot_file.write(np.ascontiguousarray(event_ids, dtype='<i8').tobytes())
+        snapshot_file.write(np.ascontiguousarray(counts, dtype='<i4').tobytes())
+    os.replace(temporary_path, path)
+
+
+def refresh_snapshot(path=None) -> int:
+    """
+    Count availability and publish it as new snapshot.
+    :return: number of events in snapshot.
+    """
+    event_ids, counts = collect_availability()
+    write_snapshot(path or get_snapshot_path(), event_ids, counts)
+    return len(event_ids)
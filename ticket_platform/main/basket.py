@@ -1,31 +1,70 @@
-from django.conf import settings
+from contextlib import ExitStack
+from decimal import Decimal
 
-from .exceptions import NonExistingTicketToRemove
-from .models import Ticket, Event, Order
+from django.db import transaction
+from django.db.models import Sum
+
+from .basket_storage import get_basket_storage
+from .exceptions import NonExistingTicketToRemove, PaymentAmountMismatch
+from .models import Ticket, Event, Order, PlatformTotals
+from .rollup import record_sale
+from .sharding import group_by_shard, shard_for_event
 
 
 class Basket:
     """
     Basket class to store reserved tickets within basket per user anonymous session.
+    Basket contains only ids of reserved tickets, kept in storage selected by 'BASKET_STORAGE' setting.
+    With sharded inventory tickets of single basket could live on many shards, they are always queried shard
+    by shard.
     """
     def __init__(self, request) -> None:
-        self.session = request.session
-        basket = self.session.get(settings.BASKET_SESSION_ID, {})
-        self.basket = basket
+        self.storage = get_basket_storage(request)
+        self.basket = self.storage.load()
         self._remove_expired_tickets()
 
-    def buy(self, name, surname) -> None:
-        """
-        Lock all ticket within the basket and create order object about transaction.
+    def buy(self, name, surname, amount=None) -> None:
+        """
+        Lock all ticket within the basket and create order object about transaction. Daily sales rollup and
+        platform totals are updated within the same transaction. Already sold tickets are skipped, order is not
+        created when all of them were sold.
+        Tickets are locked on every shard (in order of shard aliases) before anything is sold, and shard
+        transactions are committed only after order, rollup and totals are written. If commit of any shard fails,
+        tickets already sold on other shards are given back with their previous reservation time.
         :param name: name of person who buy tickets.
         :param surname: surname of person who buy tickets.
-        """
-        if self.basket.keys():
-            order = Order.objects.create(name=name, surname=surname)
-            tickets = self._get_tickets_ob_by_tickets_id_in_basket()
-            for ticket in tickets:
-                ticket.buy(order)
-            self.save()
+        :param amount: paid amount. If given, it is compared with prices of locked tickets before they are sold,
+                       and nothing is sold if they are different (PaymentAmountMismatch is raised).
+        """
+        if not self.basket:
+            return
+        with transaction.atomic():
+            order, locked = None, []
+            try:
+                with ExitStack() as shard_transactions:
+                    for database, shard_tickets in self._get_tickets_by_shard():
+                        shard_transactions.enter_context(transaction.atomic(using=database))
+                        locked.append((database, list(shard_tickets.filter(is_sold=False).select_for_update())))
+                    tickets = [ticket for _, shard_tickets in locked for ticket in shard_tickets]
+                    reservation_times = {ticket.id: ticket.reservation_time for ticket in tickets}
+                    total_price = sum((ticket.price for ticket in tickets), Decimal(0))
+                    if amount is not None and amount != total_price:
+                        raise PaymentAmountMismatch(amount, total_price)
+                    if tickets:
+                        order = Order.objects.create(name=name, surname=surname)
+                        for ticket in tickets:
+                            ticket.buy(order)
+                        record_sale(order, tickets)
+                        PlatformTotals.add(sold_tickets=len(tickets), profit=total_price)
+            except Exception:
+                if order is not None:
+                    for database, shard_tickets in locked:
+                        for ticket in shard_tickets:
+                            Ticket.objects.using(database).filter(id=ticket.id, order=order).update(
+                                is_sold=False, order=None, reservation_time=reservation_times[ticket.id]
+                            )
+                raise
+        self.save()
 
     def add(self, ticket) -> None:
         """
@@ -34,42 +73,54 @@ class Basket:
         :param ticket: Ticket object for given event.
         """
         ticket.event.increase_reservations_counter()
-        if str(ticket.id) not in self.basket:
-            self.basket[str(ticket.id)] = {
-                'price': str(ticket.price),
-                'category': ticket.category,
-            }
+        if ticket.id not in self.basket:
+            self.basket.append(ticket.id)
         ticket.reserve()
         self.save()
 
+    def add_held_tickets(self, ticket_ids) -> None:
+        """
+        Add tickets, which are already held for this basket (e.g. allocated seats), to basket.
+        :param ticket_ids: list with ids of held tickets.
+        """
+        for ticket_id in ticket_ids:
+            if ticket_id not in self.basket:
+                self.basket.append(ticket_id)
+        self.save()
+
     def save(self) -> None:
         """
-        Save current basket in session.
+        Save current basket in storage. Storage is written only if basket was changed.
         """
-        self.session[settings.BASKET_SESSION_ID] = self.basket
+        self.storage.save(self.basket)
 
     def remove(self, event_id, category) -> None:
         """
         Remove last ticket from given event and by category if such ticket exist in cart.
         :param event_id: event of ticket to remove.
-        :param category: category of ticket to remove.
+        :param category: code of category of ticket to remove.
         """
         try:
-            ticket_ids = self.basket.keys()
             event = Event.objects.get(id=int(event_id))
-            ticket = Ticket.objects.filter(id__in=ticket_ids, event=event, category=category).last()
+            ticket = Ticket.objects.using(shard_for_event(event.id)).filter(
+                id__in=self.basket, event=event, category=category
+            ).last()
             ticket.release()
         except:
             raise NonExistingTicketToRemove(event_id, category)
-        del self.basket[str(ticket.id)]
+        self.basket.remove(ticket.id)
         self.save()
 
-    def get_total_price(self) -> float:
+    def get_total_price(self) -> Decimal:
         """
-        Get a cost of all tickets from the basket.
-        :return: Amount in float format.
+        Get a cost of all tickets from the basket. Prices are taken from database, not from basket storage.
+        Total is computed once per request and basket content, so it could be used many times by templates.
+        :return: Amount in Decimal format.
         """
-        return sum([float(ticket['price']) for ticket in self.basket.values()])
+        return self.storage.memoize('total_price', lambda: sum((
+            tickets.aggregate(Sum('price', default=Decimal(0)))['price__sum']
+            for _, tickets in self._get_tickets_by_shard()
+        ), Decimal(0)))
 
     def _remove_expired_tickets(self) -> None:
         """
@@ -81,13 +132,22 @@ class Basket:
             if ticket.is_reservation_expired():
                 self.remove(ticket.event.id, ticket.category)
 
-    def _get_tickets_ob_by_tickets_id_in_basket(self):
+    def _get_tickets_by_shard(self) -> list:
+        """
+        Make query for Ticket objects from basket on each shard.
+        :return: list with (shard alias, Ticket queryset) tuples, sorted by shard alias.
+        """
+        return [
+            (database, Ticket.objects.using(database).filter(id__in=ticket_ids))
+            for database, ticket_ids in group_by_shard(self.basket)
+        ]
+
+    def _get_tickets_ob_by_tickets_id_in_basket(self) -> list:
         """
-        Make query for Ticket objects according with ticket ids from basket.
+        Get Ticket objects according with ticket ids from basket, from all shards.
         :return: Container with Tickets objects.
         """
-        ticket_ids = self.basket.keys()
-        return Ticket.objects.filter(id__in=ticket_ids)
+        return [ticket for _, tickets in self._get_tickets_by_shard() for ticket in tickets]
 
     def __iter__(self):
         """
@@ -103,10 +163,11 @@ class Basket:
                 events[event_key] = {c[1]: 0 for c in Ticket.CATEGORY}
                 events[event_key]['total_price'] = 0
 
-            events[event_key][ticket.category] += 1
+            category = ticket.get_category_display()
+            events[event_key][category] += 1
             events[event_key]['total_price'] += ticket.price
 
-            expired_time_label = f'{ticket.category}_expired_time'
+            expired_time_label = f'{category}_expired_time'
             if not events[event_key].get(expired_time_label):
                 events[event_key][expired_time_label] = ticket.reservation_time
             else:
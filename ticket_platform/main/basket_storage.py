@@ -0,0 +1,165 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+def get_basket_storage(request):
+    """
+    Get basket storage for given request. Storage is created once per request and shared by all Basket objects,
+    so basket is read only once even if it is used by view and context processor.
+    :return: storage object selected by 'BASKET_STORAGE' setting.
+    """
+    if not hasattr(request, '_basket_storage'):
+        storage_class = import_string(
+            getattr(settings, 'BASKET_STORAGE', 'main.basket_storage.SessionBasketStorage')
+        )
+        request._basket_storage = storage_class(request)
+    return request._basket_storage
+
+
+class BaseBasketStorage:
+    """
+    Base class for all basket storages. Basket is kept in compact form - sorted list of reserved ticket ids,
+    all other data (price, category, event) is taken from database when needed.
+    Storage is written only when basket content was changed. Values computed from basket content (e.g. total price)
+    could be memoized by storage, so they are shared by all Basket objects of the same request.
+    """
+    def __init__(self, request) -> None:
+        self.request = request
+        self._ticket_ids = None
+        self._computed = {}
+
+    def load(self) -> list:
+        """
+        Get ticket ids from storage. Storage is read only on first call.
+        :return: list with ticket ids.
+        """
+        if self._ticket_ids is None:
+            self._ticket_ids = self._decode(self._read())
+        return list(self._ticket_ids)
+
+    def memoize(self, name, compute):
+        """
+        Get value computed from basket content. Value is computed once per request, until basket is changed.
+        :param name: name of value.
+        :param compute: function without arguments, which computes value.
+        :return: computed value.
+        """
+        ticket_ids = tuple(self.load())
+        memoized = self._computed.get(name)
+        if memoized is None or memoized[0] != ticket_ids:
+            memoized = self._computed[name] = (ticket_ids, compute())
+        return memoized[1]
+
+    @property
+    def version(self) -> str:
+        """
+        Version of basket content, changed every time when basket is changed. Reading it doesn't touch database.
+        """
+        return hashlib.md5(','.join(map(str, self.load())).encode()).hexdigest()
+
+    def save(self, ticket_ids) -> bool:
+        """
+        Save ticket ids in storage, if they are different than stored ones.
+        :param ticket_ids: container with ticket ids.
+        :return: True if storage was written.
+        """
+        ticket_ids = self._decode(ticket_ids)
+        if ticket_ids == self.load():
+            return False
+        self._write(ticket_ids)
+        self._ticket_ids = ticket_ids
+        return True
+
+    def update(self, response) -> None:
+        """
+        Hook launched by BasketStorageMiddleware before response is returned.
+        """
+
+    @staticmethod
+    def _decode(data) -> list:
+        """
+        Turn stored data into sorted list of ticket ids. Old baskets, stored as dictionary with ticket ids as keys,
+        are supported as well.
+        """
+        if not data:
+            return []
+        return sorted({int(ticket_id) for ticket_id in data})
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _write(self, ticket_ids) -> None:
+        raise NotImplementedError
+
+
+class SessionBasketStorage(BaseBasketStorage):
+    """
+    Basket stored in user session, under 'BASKET_SESSION_ID' key.
+    """
+    def _read(self):
+        return self.request.session.get(settings.BASKET_SESSION_ID)
+
+    def _write(self, ticket_ids) -> None:
+        self.request.session[settings.BASKET_SESSION_ID] = ticket_ids
+
+
+class CacheBasketStorage(BaseBasketStorage):
+    """
+    Basket stored in cache selected by 'BASKET_CACHE_ALIAS' setting, under key created from session key.
+    """
+    def __init__(self, request) -> None:
+        super().__init__(request)
+        self.cache = caches[getattr(settings, 'BASKET_CACHE_ALIAS', 'default')]
+
+    def _get_key(self) -> str:
+        return f"{settings.BASKET_SESSION_ID}:{self.request.session.session_key}"
+
+    def _read(self):
+        if not self.request.session.session_key:
+            return None
+        return self.cache.get(self._get_key())
+
+    def _write(self, ticket_ids) -> None:
+        if not self.request.session.session_key:
+            self.request.session.save()
+            self.request.session.modified = True
+        self.cache.set(self._get_key(), ticket_ids, timeout=settings.SESSION_COOKIE_AGE)
+
+
+class SignedCookieBasketStorage(BaseBasketStorage):
+    """
+    Basket stored in signed cookie, named by 'BASKET_COOKIE_NAME' setting. Cookie is set on response
+    by BasketStorageMiddleware.
+    """
+    salt = 'main.basket'
+
+    def __init__(self, request) -> None:
+        super().__init__(request)
+        self.cookie_name = getattr(settings, 'BASKET_COOKIE_NAME', 'basket')
+        self._changed = False
+
+    def _read(self):
+        data = self.request.get_signed_cookie(self.cookie_name, default='', salt=self.salt)
+        return [ticket_id for ticket_id in data.split(',') if ticket_id.isdigit()]
+
+    def _write(self, ticket_ids) -> None:
+        self._changed = True
+
+    def update(self, response) -> None:
+        if not self._changed:
+            return
+        if self._ticket_ids:
+            response.set_signed_cookie(
+                self.cookie_name,
+                ','.join(map(str, self._ticket_ids)),
+                salt=self.salt,
+                max_age=settings.SESSION_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(self.cookie_name, samesite='Lax')
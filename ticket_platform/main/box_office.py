@@ -0,0 +1,137 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .exceptions import BoxOfficeError, IdempotencyKeyReused, LotteryPending, NotEnoughTickets, TicketsTakenMeanwhile
+from .fragment_cache import bump_inventory_version
+from .lottery import get_pending_lottery_events
+from .models import BoxOfficeRequest, Event, Order, PlatformTotals, Ticket
+from .rollup import record_sale
+from .sharding import shard_for_event
+
+
+def parse_lines(lines) -> list:
+    """
+    Validate lines of box office request. Lines with the same event and category are merged.
+    :param lines: list of dictionaries with 'event_id', 'category' (label or code) and 'quantity'.
+    :return: list with (event id, category code, quantity) tuples.
+    """
+    if not isinstance(lines, list) or not lines:
+        raise BoxOfficeError("Request has to contain non-empty list of lines.")
+    quantities = {}
+    for line in lines:
+        try:
+            event_id, category, quantity = int(line['event_id']), line['category'], int(line['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise BoxOfficeError("Every line needs 'event_id', 'category' and 'quantity'.")
+        category = Ticket.CATEGORY_CODES.get(category, category) if isinstance(category, str) else None
+        if category not in dict(Ticket.CATEGORY) or quantity < 1:
+            raise BoxOfficeError(f"Wrong category or quantity for event with id {event_id}.")
+        quantities[(event_id, category)] = quantities.get((event_id, category), 0) + quantity
+    if sum(quantities.values()) > getattr(settings, 'BOX_OFFICE_MAX_TICKETS', 1000):
+        raise BoxOfficeError("Too many tickets in single request.")
+    return [(event_id, category, quantity) for (event_id, category), quantity in sorted(quantities.items())]
+
+
+def sell_lines(order, lines, now) -> list:
+    """
+    Take available tickets for every line and sell them within given order. Tickets of each shard are taken and sold
+    in single transaction with one update, shards are processed in order of their aliases. If any shard fails,
+    tickets already sold on previous shards are given back.
+    :param order: Order object.
+    :param lines: list with (event id, category code, quantity) tuples.
+    :param now: time of purchase.
+    :return: list with ids of sold tickets.
+    """
+    by_shard = {}
+    for line in lines:
+        by_shard.setdefault(shard_for_event(line[0]), []).append(line)
+    ticket_ids, committed = [], []
+    try:
+        for database, shard_lines in sorted(by_shard.items(), key=lambda group: group[0] or ''):
+            tickets = Ticket.objects.using(database)
+            with transaction.atomic(using=database):
+                shard_ticket_ids = []
+                for event_id, category, quantity in shard_lines:
+                    ids = list(tickets.filter(
+                        event_id=event_id, category=category, is_sold=False, reservation_time__lt=now
+                    ).order_by('id').select_for_update(skip_locked=True).values_list('id', flat=True)[:quantity])
+                    if len(ids) < quantity:
+                        raise NotEnoughTickets(event_id, quantity, dict(Ticket.CATEGORY)[category])
+                    shard_ticket_ids.extend(ids)
+                sold = tickets.filter(
+                    id__in=shard_ticket_ids, is_sold=False, reservation_time__lt=now
+                ).update(is_sold=True, order=order, reservation_time=now)
+                if sold != len(shard_ticket_ids):
+                    raise TicketsTakenMeanwhile()
+            committed.append(database)
+            ticket_ids.extend(shard_ticket_ids)
+    except Exception:
+        for database in committed:
+            Ticket.objects.using(database).filter(order=order).update(is_sold=False, order=None)
+        raise
+    return ticket_ids
+
+
+def get_fingerprint(name, surname, lines) -> str:
+    return hashlib.sha256(json.dumps([name, surname, lines]).encode()).hexdigest()
+
+
+def replay(box_office_request, fingerprint) -> dict:
+    if box_office_request.fingerprint != fingerprint:
+        raise IdempotencyKeyReused()
+    return box_office_request.response
+
+
+def purchase(key, name, surname, lines) -> tuple:
+    """
+    Buy tickets for many events and categories at once. Everything is done within one transaction: idempotency key
+    is claimed, order is created, tickets are sold and sales rollup and platform totals are updated.
+    :param key: idempotency key given by client.
+    :param name: name of buyer.
+    :param surname: surname of buyer.
+    :param lines: list of dictionaries with 'event_id', 'category' and 'quantity'.
+    :return: tuple with response dictionary and flag if tickets were bought by this call (False for repeated key).
+    """
+    lines = parse_lines(lines)
+    fingerprint = get_fingerprint(name, surname, lines)
+    previous = BoxOfficeRequest.objects.filter(key=key).first()
+    if previous is not None:
+        return replay(previous, fingerprint), False
+
+    now = timezone.now()
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                box_office_request = BoxOfficeRequest.objects.create(key=key, fingerprint=fingerprint)
+        except IntegrityError:
+            return replay(BoxOfficeRequest.objects.get(key=key), fingerprint), False
+        event_ids = {event_id for event_id, _, _ in lines}
+        missing = event_ids - set(Event.objects.filter(
+            id__in=event_ids, time_and_date__gt=now
+        ).values_list('id', flat=True))
+        if missing:
+            raise BoxOfficeError(f"Events with ids {sorted(missing)} don't exist or already took place.")
+        pending = get_pending_lottery_events(event_ids)
+        if pending:
+            raise LotteryPending(pending)
+
+        order = Order.objects.create(name=name, surname=surname)
+        ticket_ids = sell_lines(order, lines, now)
+        sold_tickets = []
+        for database in {shard_for_event(event_id) for event_id in event_ids}:
+            sold_tickets.extend(Ticket.objects.using(database).filter(order=order).only('category', 'price'))
+        record_sale(order, sold_tickets)
+        total_price = sum(ticket.price for ticket in sold_tickets)
+        PlatformTotals.add(sold_tickets=len(sold_tickets), profit=total_price)
+
+        response = {'order_id': order.id, 'tickets': sorted(ticket_ids), 'total_price': str(total_price)}
+        box_office_request.order = order
+        box_office_request.response = response
+        box_office_request.save()
+    for event_id in event_ids:
+        bump_inventory_version(event_id)
+    return response, True
@@ -1,5 +1,18 @@
+from django.utils.functional import SimpleLazyObject
+
 from .basket import Basket
+from .basket_storage import get_basket_storage
+from .fragment_cache import get_fragment_cache_timeout
 
 
 def basket(request):
-    return {'basket': Basket(request)}
+    """
+    Basket is created only when it is used by template, so cached fragments don't need it at all. Fragments showing
+    basket are cached per session and basket version.
+    """
+    return {
+        'basket': SimpleLazyObject(lambda: Basket(request)),
+        'basket_owner': getattr(getattr(request, 'session', None), 'session_key', None),
+        'basket_version': get_basket_storage(request).version,
+        'fragment_cache_timeout': get_fragment_cache_timeout(),
+    }
@@ -13,3 +13,57 @@ class NonExistingTicketToRemove(BaseBasketExceptions):
     def __init__(self, event_id, category) -> None:
         message = self.template.format(event_id, category)
         super().__init__(message)
+
+
+class BoxOfficeError(Exception):
+    """Box office request which couldn't be fulfilled."""
+
+    status = 400
+
+
+class NotEnoughTickets(BoxOfficeError):
+    """Not enough available tickets for one of box office lines."""
+
+    status = 409
+    template = "Event with id {} hasn't {} available tickets for category: {}."
+
+    def __init__(self, event_id, quantity, category) -> None:
+        message = self.template.format(event_id, quantity, category)
+        super().__init__(message)
+
+
+class TicketsTakenMeanwhile(BoxOfficeError):
+    """Selected tickets were sold or held by other buyer before they were sold by box office."""
+
+    status = 409
+
+    def __init__(self) -> None:
+        super().__init__("Tickets were taken by other buyers meanwhile, try again.")
+
+
+class LotteryPending(BoxOfficeError):
+    """Tickets of event are waiting for lottery allocation, so they couldn't be sold."""
+
+    status = 409
+
+    def __init__(self, event_ids) -> None:
+        super().__init__(f"Tickets of events with ids {event_ids} are allocated by lottery.")
+
+
+class IdempotencyKeyReused(BoxOfficeError):
+    """Idempotency key sent again with different purchase."""
+
+    status = 422
+
+    def __init__(self) -> None:
+        super().__init__("Idempotency key was already used for different purchase.")
+
+
+class PaymentAmountMismatch(BaseBasketExceptions):
+    """Paid amount is different than current price of tickets in basket."""
+
+    template = "Paid amount {} doesn't match price of tickets {}."
+
+    def __init__(self, amount, total_price) -> None:
+        message = self.template.format(amount, total_price)
+        super().__init__(message)
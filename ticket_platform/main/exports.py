@@ -0,0 +1,88 @@
+import csv
+import heapq
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ArchivedOrder, ArchivedTicket, Event, Order, Ticket
+from .sharding import get_ticket_databases
+
+EXPORT_FIELDS = (
+    "order_id", "order_time", "name", "surname", "ticket_id", "event_id", "event_name", "event_time", "category",
+    "price",
+)
+
+
+class Echo:
+    """
+    Pseudo buffer for csv.writer, which return written line instead of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+def get_sold_tickets(chunk_size=2000):
+    """
+    Get all sold tickets, archived ones included, together with their orders and events, sorted by order. Tickets
+    and archived tickets are read in chunks and merged, orders and events are fetched once per chunk, so export use
+    constant memory regardless of number of sold tickets.
+    :param chunk_size: number of tickets fetched from database at once.
+    :return: iterator with rows of export, in order given by EXPORT_FIELDS.
+    """
+    archive = getattr(settings, 'ARCHIVE_DATABASE', 'default')
+    fields = ('order_id', 'id', 'event_id', 'category', 'price')
+    tickets = heapq.merge(*(
+        source.filter(is_sold=True).order_by('order_id', 'id').values_list(*fields).iterator(chunk_size=chunk_size)
+        for source in [Ticket.objects.using(database) for database in get_ticket_databases()] + [
+            ArchivedTicket.objects.using(archive)
+        ]
+    ))
+    categories = dict(Ticket.CATEGORY)
+    while True:
+        chunk = list(islice(tickets, chunk_size))
+        if not chunk:
+            return
+        order_ids = {ticket[0] for ticket in chunk}
+        orders = Order.objects.in_bulk(order_ids)
+        orders.update(ArchivedOrder.objects.using(archive).in_bulk(order_ids - orders.keys()))
+        events = Event.objects.in_bulk({ticket[2] for ticket in chunk})
+        for order_id, ticket_id, event_id, category, price in chunk:
+            order, event = orders[order_id], events[event_id]
+            yield (
+                order_id,
+                order.time_and_date,
+                order.name,
+                order.surname,
+                ticket_id,
+                event_id,
+                event.name,
+                event.time_and_date,
+                categories[category],
+                price,
+            )
+
+
+def iter_csv(rows):
+    """
+    Yield export as CSV lines, starting from header.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(rows):
+    """
+    Yield export as JSON lines, one object per sold ticket.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "jsonl": (iter_jsonl, "application/x-ndjson"),
+}
@@ -7,3 +7,31 @@ class PaymentForm(forms.Form):
     surname = forms.CharField(max_length=30)
     currency = forms.ChoiceField(choices=Order.CURRENCY)
     amount = forms.DecimalField(max_digits=10, decimal_places=2)
+
+
+class EventSearchForm(forms.Form):
+    q = forms.CharField(max_length=30, required=False)
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    available = forms.BooleanField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            # Search is run with valid fields of invalid form too, so wrong date range is not applied at all.
+            del cleaned_data['date_from'], cleaned_data['date_to']
+            self.add_error(None, "Start date must be before end date.")
+        return cleaned_data
+
+
+class SalesChartForm(forms.Form):
+    RESOLUTIONS = (
+        ("auto", "Auto"),
+        ("day", "Day"),
+        ("week", "Week"),
+        ("month", "Month"),
+    )
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    resolution = forms.ChoiceField(choices=RESOLUTIONS, required=False)
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def get_fragment_cache_timeout() -> int:
+    """
+    Timeout of cached template fragments. Expired reservations free tickets without any write, so cached
+    availability could be outdated up to this number of seconds.
+    """
+    return getattr(settings, 'TEMPLATE_FRAGMENT_CACHE_TIMEOUT', 60)
+
+
+def _get_inventory_version_key(event_id) -> str:
+    return f"inventory_version:{event_id}"
+
+
+def bump_inventory_version(event_id) -> None:
+    """
+    Mark that event or its tickets were changed, so all fragments cached for previous version are outdated.
+    :param event_id: id of changed event.
+    """
+    key = _get_inventory_version_key(event_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_inventory_versions(event_ids) -> dict:
+    """
+    Get current inventory versions of given events, with single cache query. Missing versions are started from
+    current time, so version evicted from cache is never reused.
+    :param event_ids: container with ids of events.
+    :return: dictionary with event id: version.
+    """
+    keys = {_get_inventory_version_key(event_id): event_id for event_id in event_ids}
+    versions = cache.get_many(keys.keys())
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return {keys[key]: version for key, version in versions.items()}
@@ -1,11 +1,13 @@
 from abc import ABC
 
-from django.db.models import Sum, Min, Max
+from django.conf import settings
+from django.db.models import Min, Max, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
 from django.utils import timezone
 from plotly import graph_objects, offline
 
-from .models import Order, Ticket
-from .utils import turn_none_into_zero, time_between
+from .models import DailySales, Ticket
+from .utils import time_between, buckets_between, downsample_lttb
 
 
 class LineChartAbstract(ABC):
@@ -75,24 +77,145 @@ class LineChartAbstract(ABC):
 
 class OrderPlotter(LineChartAbstract):
     """
-    Dedicated plotter of 'Order' object, based on LineChartAbstract.
+    Dedicated plotter of 'Order' object, based on LineChartAbstract. Data are taken from daily sales rollup,
+    so cost of chart depends on number of days, not on number of orders. Days could be limited to date window
+    and grouped into weekly or monthly buckets, summed up by database. With 'auto' resolution the finest one giving
+    at most 'max_points' buckets is taken, series still longer than that are downsampled with LTTB.
     """
-    def __init__(self):
-        self.object_to_plot = Order
+    RESOLUTIONS = ("day", "week", "month")
+    TRUNCATE = {"week": TruncWeek, "month": TruncMonth}
+    BUCKET_DAYS = {"day": 1, "week": 7, "month": 31}
+
+    def __init__(self, date_from=None, date_to=None, resolution="auto", max_points=None):
+        """
+        :param date_from: first day of chart, by default the first day of sale.
+        :param date_to: last day of chart, by default the last day of sale.
+        :param resolution: 'day', 'week', 'month' or 'auto'.
+        :param max_points: maximal number of points per trace, 'CHART_MAX_POINTS' setting by default.
+        """
+        self.object_to_plot = DailySales
+        self.date_from = date_from
+        self.date_to = date_to
+        self.requested_resolution = resolution
+        self.max_points = max_points or getattr(settings, 'CHART_MAX_POINTS', 365)
+        self._resolution = None
+        self._days_range = None
+        self._values = None
+
+    def get_sales(self):
+        """
+        Get rollup rows within date window.
+        """
+        sales = DailySales.objects.all()
+        if self.date_from:
+            sales = sales.filter(date__gte=self.date_from)
+        if self.date_to:
+            sales = sales.filter(date__lte=self.date_to)
+        return sales
+
+    def get_first_date_of_occurence(self):
+        """
+        Get the first day with any order.
+        :return: datetime.date
+        """
+        return self.get_sales().aggregate(Min('date'))['date__min']
+
+    def get_last_date_of_occurence(self):
+        """
+        Get the last day with any order.
+        :return: datetime.date
+        """
+        return self.get_sales().aggregate(Max('date'))['date__max']
+
+    @property
+    def resolution(self) -> str:
+        """
+        Size of single chart bucket: 'day', 'week' or 'month'.
+        """
+        if self._resolution is None:
+            self._resolution = self.requested_resolution
+            if self._resolution not in self.RESOLUTIONS:
+                self._resolution = self.RESOLUTIONS[-1]
+                days_range = self._get_dates()
+                if days_range:
+                    days = (days_range[1] - days_range[0]).days + 1
+                    for resolution in self.RESOLUTIONS:
+                        if days / self.BUCKET_DAYS[resolution] <= self.max_points:
+                            self._resolution = resolution
+                            break
+        return self._resolution
+
+    def _get_dates(self) -> tuple:
+        dates = self.get_sales().aggregate(Min('date'), Max('date'))
+        if dates['date__min'] is None:
+            return ()
+        return dates['date__min'], dates['date__max']
+
+    def get_days_range(self):
+        """
+        List with first days of all buckets between the first and the last day of sale (both included). Default
+        value for x axis in all charts. Range is calculated only once per plotter.
+        :return: list of dates in datetime.date() format.
+        """
+        if self._days_range is None:
+            dates = self._get_dates()
+            self._days_range = list(buckets_between(*dates, self.resolution)) if dates else []
+        return self._days_range
+
+    def get_values(self) -> dict:
+        """
+        Get all rollup fields for each bucket and category with single query. Buckets coarser than day are summed
+        up by database.
+        :return: dictionary with (first day of bucket, category): (orders, tickets_sold, revenue).
+        """
+        if self._values is None:
+            sales = self.get_sales()
+            if self.resolution in self.TRUNCATE:
+                rows = sales.annotate(
+                    bucket=self.TRUNCATE[self.resolution]('date')
+                ).values_list('bucket', 'category').annotate(Sum('orders'), Sum('tickets_sold'), Sum('revenue'))
+            else:
+                rows = sales.values_list('date', 'category', 'orders', 'tickets_sold', 'revenue')
+            self._values = {(bucket, category): values for bucket, category, *values in rows}
+        return self._values
+
+    def get_daily_values(self, field, category=DailySales.ALL_CATEGORIES) -> list:
+        """
+        Get values of given rollup field for each bucket in days range.
+        :param field: name of DailySales field (orders, tickets_sold, revenue).
+        :param category: ticket category, by default totals of all categories are taken.
+        :return: list with values per bucket, 0 for buckets without sale.
+        """
+        index = ("orders", "tickets_sold", "revenue").index(field)
+        values = self.get_values()
+        return [values[(day, category)][index] if (day, category) in values else 0 for day in self.get_days_range()]
+
+    def add_trace_to_fig(self, fig, y, name):
+        """
+        Add additional line to existing figure, downsampled to 'max_points' points.
+        :param fig: Figure to plot
+        :param y: y_axis with data to present
+        :param name: title of the generated plot
+        :return:
+        """
+        x, y = downsample_lttb(self.get_days_range(), y, self.max_points)
+        fig.add_trace(graph_objects.Scatter(x=x, y=y, name=name))
+        return fig
+
+    def get_number_of_objects_per_day(self):
+        """
+        Get number of orders per day.
+        :return: list with numbers of orders per day.
+        """
+        return self.get_daily_values('orders')
 
     def get_number_of_sold_tickets_by_category(self, category) -> list:
         """
         Get list with all sold ticket by category per day.
-        :param category: ticket category (normal, premium, vip)
+        :param category: ticket category code (N, P, V)
         :return: list with number of ticket by category per day.
         """
-        return [
-            self.object_to_plot.objects.filter(
-                time_and_date__date=time.date(), ticket__category=category
-            ).count() for time in time_between(
-                self.get_first_date_of_occurence(), self.get_last_date_of_occurence()
-            )
-        ]
+        return self.get_daily_values('tickets_sold', category)
 
     def get_chart_with_number_of_orders_per_day(self) -> offline.plot:
         """
@@ -100,12 +223,12 @@ class OrderPlotter(LineChartAbstract):
         :return: chart save as plot object.
         """
         fig = graph_objects.Figure()
-        self.add_trace_to_fig(fig, self.get_number_of_objects_per_day(), "Number of Orders per day.")
-        self.add_trace_to_fig(fig, self.get_sold_tickets_per_day(), "Sold tickets per day.")
+        self.add_trace_to_fig(fig, self.get_number_of_objects_per_day(), f"Number of Orders per {self.resolution}.")
+        self.add_trace_to_fig(fig, self.get_sold_tickets_per_day(), f"Sold tickets per {self.resolution}.")
         for category in Ticket.CATEGORY:
             self.add_trace_to_fig(
                 fig,
-                self.get_number_of_sold_tickets_by_category(category[1]),
+                self.get_number_of_sold_tickets_by_category(category[0]),
                 f"Solved ticket for {category[1]} category."
             )
         return offline.plot(fig, output_type="div")
@@ -116,46 +239,22 @@ class OrderPlotter(LineChartAbstract):
         order object.
         :return: list with number of solved tickets per day.
         """
-        return [
-            self.object_to_plot.objects.filter(
-                time_and_date__date=time.date()
-            ).values('ticket').count() for time in time_between(
-                self.get_first_date_of_occurence(), self.get_last_date_of_occurence()
-            )
-        ]
+        return self.get_daily_values('tickets_sold')
 
     def get_amount_of_cash_from_tickets_per_day_total(self) -> list:
         """
         Return a total profits from all tickets grouped by each day.
         :return: list with amounts of profits in days range.
         """
-        data = [
-            self.object_to_plot.objects.filter(
-                time_and_date__date=time.date()
-            ).values('ticket__price'
-                     ).aggregate(Sum('ticket__price'))['ticket__price__sum'] for time in time_between(
-                self.get_first_date_of_occurence(), self.get_last_date_of_occurence()
-            )
-        ]
-        data = list(map(turn_none_into_zero, data))
-        return data
+        return self.get_daily_values('revenue')
 
     def get_amount_of_cash_from_ticket_per_day_for_category(self, category) -> list:
         """
         Show amount of cash per day group by each day and category
-        :param category: category of ticket to query
+        :param category: code of category of ticket to query
         :return: list of amount of cash per day
         """
-        data = [self.object_to_plot.objects.filter(
-            time_and_date__date=time.date(),
-            ticket__category=category
-        ).values('ticket__price'
-                 ).aggregate(Sum('ticket__price', default=0))['ticket__price__sum'] for time in time_between(
-            self.get_first_date_of_occurence(), self.get_last_date_of_occurence()
-        )
-                ]
-        data = list(map(turn_none_into_zero, data))
-        return data
+        return self.get_daily_values('revenue', category)
 
     def get_chart_with_profits_per_day(self) -> offline.plot:
         """
@@ -165,12 +264,12 @@ class OrderPlotter(LineChartAbstract):
         self.add_trace_to_fig(
             fig,
             self.get_amount_of_cash_from_tickets_per_day_total(),
-            "Amount of cash from tickets per day."
+            f"Amount of cash from tickets per {self.resolution}."
         )
         for category in Ticket.CATEGORY:
             self.add_trace_to_fig(
                 fig,
-                self.get_amount_of_cash_from_ticket_per_day_for_category(category[1]),
+                self.get_amount_of_cash_from_ticket_per_day_for_category(category[0]),
                 f"Solved ticket for {category[1]} category."
             )
         return offline.plot(fig, output_type="div")
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .basket import Basket
+from .fragment_cache import bump_inventory_version
+from .models import Event, LotteryEntry, Ticket
+from .sharding import shard_for_event
+
+LOTTERY_SESSION_FLAG = 'lottery_entered'
+ALLOCATION_MODES = ("random", "weighted")
+
+
+def get_entrant(request) -> str:
+    """
+    Get key of entrant - session key, created if session doesn't exist yet.
+    """
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+
+def get_pending_lottery_events(event_ids) -> list:
+    """
+    Get events, whose tickets are waiting for lottery allocation, so they couldn't be sold by any sale path.
+    :param event_ids: ids of checked events.
+    :return: sorted list with ids of events with pending lottery.
+    """
+    return sorted(Event.objects.filter(
+        id__in=event_ids, lottery_closes_at__isnull=False, lottery_allocated=False
+    ).values_list('id', flat=True))
+
+
+def enter_lottery(request, event, category, quantity) -> bool:
+    """
+    Add entry of current session to lottery of event. Entry is single insert, second entry of the same session
+    is ignored.
+    :param event: Event object with open lottery.
+    :param category: code of ticket category.
+    :param quantity: number of requested tickets, limited by 'LOTTERY_MAX_QUANTITY' setting.
+    :return: True if entry was added.
+    """
+    quantity = min(quantity, getattr(settings, 'LOTTERY_MAX_QUANTITY', 4))
+    if not event.is_lottery_open() or category not in dict(Ticket.CATEGORY) or quantity < 1:
+        return False
+    try:
+        with transaction.atomic():
+            LotteryEntry.objects.create(
+                event=event, entrant=get_entrant(request), category=category, quantity=quantity, weight=1 / quantity
+            )
+    except IntegrityError:
+        return False
+    request.session[LOTTERY_SESSION_FLAG] = True
+    return True
+
+
+def draw_order(weights, seed=None):
+    """
+    Get random order of entries, where entry with bigger weight is more likely to be drawn earlier (weighted
+    sampling without replacement, each entry gets key 'log(u) / weight' and keys are sorted).
+    :param weights: list with positive weights of entries.
+    :param seed: optional seed, so allocation could be repeated.
+    :return: array with indexes of entries in draw order.
+    """
+    # NumPy is heavy, so it is imported only when lottery is really drawn.
+    import numpy as np
+
+    weights = np.asarray(weights, dtype=float)
+    if not np.all(weights > 0):
+        raise ValueError("Weights of lottery entries have to be positive.")
+    keys = np.log(np.random.default_rng(seed).random(len(weights))) / weights
+    return np.argsort(-keys, kind='stable')
+
+
+def allocate_lottery(event, mode="weighted", seed=None, hold_minutes=None, batch_size=1000) -> tuple:
+    """
+    Allocate available tickets of event among pending entries in one pass. Entries are drawn in random (or weighted
+    random) order and each of them gets all requested tickets of its category, or nothing if there are not enough
+    of them left. Tickets of winners are held with bulk updates, so they could be claimed into basket later, entries
+    are marked as won or lost with bulk updates as well.
+    :param event: Event object with closed entry window.
+    :param mode: 'random' (every entry has the same chance) or 'weighted' (chance of entry is given by its weight).
+    :param seed: optional seed of draw.
+    :param hold_minutes: how long tickets are held for winners, 'LOTTERY_HOLD_MINUTES' setting by default.
+    :param batch_size: maximal number of rows changed by single update.
+    :return: tuple with number of won and lost entries.
+    """
+    if hold_minutes is None:
+        hold_minutes = getattr(settings, 'LOTTERY_HOLD_MINUTES', 24 * 60)
+    now = timezone.now()
+    database = shard_for_event(event.id)
+    with transaction.atomic(), transaction.atomic(using=database):
+        entries = list(LotteryEntry.objects.filter(
+            event=event, status=LotteryEntry.PENDING
+        ).order_by('id').values_list('id', 'category', 'quantity', 'weight'))
+        available = {code: [] for code, _ in Ticket.CATEGORY}
+        for ticket_id, category in Ticket.objects.using(database).filter(
+            event=event, is_sold=False, reservation_time__lt=now
+        ).order_by('id').values_list('id', 'category'):
+            available[category].append(ticket_id)
+
+        weights = [entry[3] if mode == "weighted" else 1.0 for entry in entries]
+        positions = {code: 0 for code in available}
+        won, lost_ids, held_ids = [], [], []
+        for index in draw_order(weights, seed):
+            entry_id, category, quantity, _ = entries[index]
+            start = positions[category]
+            ticket_ids = available[category][start:start + quantity]
+            if len(ticket_ids) < quantity:
+                lost_ids.append(entry_id)
+                continue
+            positions[category] += quantity
+            won.append(LotteryEntry(id=entry_id, status=LotteryEntry.WON, ticket_ids=ticket_ids))
+            held_ids.extend(ticket_ids)
+
+        hold_until = now + timezone.timedelta(minutes=hold_minutes)
+        for start in range(0, len(held_ids), batch_size):
+            batch = held_ids[start:start + batch_size]
+            held = Ticket.objects.using(database).filter(
+                id__in=batch, is_sold=False, reservation_time__lt=now
+            ).update(reservation_time=hold_until)
+            if held != len(batch):
+                raise RuntimeError(f"Tickets of event {event.id} were taken during lottery allocation.")
+        LotteryEntry.objects.bulk_update(won, ['status', 'ticket_ids'], batch_size=batch_size)
+        for start in range(0, len(lost_ids), batch_size):
+            LotteryEntry.objects.filter(id__in=lost_ids[start:start + batch_size]).update(status=LotteryEntry.LOST)
+        Event.objects.filter(id=event.id).update(lottery_allocated=True)
+    bump_inventory_version(event.id)
+    return len(won), len(lost_ids)
+
+
+def get_events_to_allocate():
+    """
+    Get lottery events with closed entry window, which weren't allocated yet.
+    """
+    return Event.objects.filter(lottery_closes_at__lte=timezone.now(), lottery_allocated=False)
+
+
+def claim_lottery_wins(request) -> list:
+    """
+    Add tickets won by current session to its basket. Database is asked only for sessions which entered any lottery.
+    :return: list with ids of claimed tickets.
+    """
+    if not request.session.get(LOTTERY_SESSION_FLAG):
+        return []
+    entries = LotteryEntry.objects.filter(
+        entrant=request.session.session_key, status__in=(LotteryEntry.PENDING, LotteryEntry.WON)
+    )
+    won = [entry for entry in entries if entry.status == LotteryEntry.WON]
+    ticket_ids = [ticket_id for entry in won for ticket_id in entry.ticket_ids]
+    if ticket_ids:
+        Basket(request).add_held_tickets(ticket_ids)
+        LotteryEntry.objects.filter(id__in=[entry.id for entry in won]).update(status=LotteryEntry.CLAIMED)
+    if len(won) == len(entries):
+        del request.session[LOTTERY_SESSION_FLAG]
+    return ticket_ids
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from main.lottery import ALLOCATION_MODES, allocate_lottery, get_events_to_allocate
+
+
+class Command(BaseCommand):
+    help = "Allocate tickets of lottery events with closed entry window among their entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=ALLOCATION_MODES, default="weighted")
+        parser.add_argument('--seed', type=int, default=None, help="Seed of draw, to repeat allocation.")
+        parser.add_argument('--hold-minutes', type=int, default=None, help="How long tickets are held for winners.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for event in get_events_to_allocate():
+            won, lost = allocate_lottery(
+                event,
+                mode=options['mode'],
+                seed=options['seed'],
+                hold_minutes=options['hold_minutes'],
+                batch_size=options['batch_size'],
+            )
+            self.stdout.write(f"Event {event.id} ({event.name}): {won} entries won, {lost} lost.")
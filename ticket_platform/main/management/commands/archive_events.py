@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.archive import archive_event, get_events_to_archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move tickets and orders of past events to archive tables. Archive could be kept in separate database, "
+        "which has to be migrated first with 'migrate --database <alias>'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Archive events older than given number of days.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--database', default=getattr(settings, 'ARCHIVE_DATABASE', 'default'))
+
+    def handle(self, *args, **options):
+        for event in get_events_to_archive(options['days']):
+            moved = archive_event(event, batch_size=options['batch_size'], using=options['database'])
+            self.stdout.write(f"Event {event.id} ({event.name}): {moved} tickets archived.")
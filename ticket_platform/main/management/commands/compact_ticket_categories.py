@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import Ticket, ArchivedTicket, DailySales
+
+
+class Command(BaseCommand):
+    help = (
+        "Replace category labels (Normal, Premium, VIP) stored in existing rows with one char codes (N, P, V). "
+        "Has to be launched before columns are migrated to the new, shorter size."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model in (Ticket, ArchivedTicket, DailySales):
+                for label, code in Ticket.CATEGORY_CODES.items():
+                    updated = model.objects.filter(category=label).update(category=code)
+                    if updated:
+                        self.stdout.write(f"{model.__name__}: {updated} rows changed from {label} to {code}.")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.exports import EXPORT_FORMATS, get_sold_tickets
+
+
+class Command(BaseCommand):
+    help = "Export all sold tickets with their orders as CSV or JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS.keys(), default='csv')
+        parser.add_argument('--output', help="Path of output file. Export is written to stdout by default.")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        iter_export, _ = EXPORT_FORMATS[options['format']]
+        lines = iter_export(get_sold_tickets(chunk_size=options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,15 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from main.rollup import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Recreate daily sales rollup used by charts from existing orders, archived ones included."
+
+    def handle(self, *args, **options):
+        try:
+            created = rebuild_daily_sales()
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        self.stdout.write(f"Daily sales rollup rebuilt: {created} rows.")
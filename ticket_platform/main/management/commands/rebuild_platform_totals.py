@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.models import PlatformTotals
+
+
+class Command(BaseCommand):
+    help = "Count global totals shown in stats footer from scratch."
+
+    def handle(self, *args, **options):
+        totals = PlatformTotals.rebuild()
+        self.stdout.write(
+            f"Events: {totals.events}, tickets: {totals.tickets}, sold tickets: {totals.sold_tickets}, "
+            f"profit: {totals.profit}, possible profit: {totals.possible_profit}."
+        )
@@ -0,0 +1,37 @@
+import fcntl
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.availability import get_snapshot_interval, get_snapshot_path, refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep availability snapshot, shared by all workers on host, up to date. Only one refresher per snapshot file "
+        "could run at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=get_snapshot_path())
+        parser.add_argument(
+            '--interval', type=float, default=get_snapshot_interval(),
+            help="Seconds between snapshots."
+        )
+        parser.add_argument('--once', action='store_true', help="Write single snapshot and exit.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError("Set 'AVAILABILITY_SNAPSHOT_PATH' setting or give --path.")
+        with open(f"{path}.lock", 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise CommandError(f"Another refresher is already running for {path}.")
+            while True:
+                events = refresh_snapshot(path)
+                if options['once']:
+                    self.stdout.write(f"Snapshot with {events} events written to {path}.")
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.repricing import RepricingEngine
+from main.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Reprice unsold tickets of future events according to demand. Sold tickets and tickets held in baskets "
+        "are never changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events', help="Reprice only given event.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help="Compute new prices without saving them.")
+
+    def handle(self, *args, **options):
+        # Engine loads tickets together with dates of their events, which are on another database than shards.
+        if get_shards():
+            raise CommandError("Tickets couldn't be repriced when 'TICKET_SHARDS' setting is used.")
+        engine = RepricingEngine()
+        loaded = engine.load(options['events'])
+        new_prices = engine.compute()
+        changed = int((new_prices != engine.prices).sum())
+        if options['dry_run']:
+            self.stdout.write(f"{loaded} tickets checked, {changed} prices would change.")
+            return
+        updated = engine.apply(new_prices, batch_size=options['batch_size'])
+        self.stdout.write(f"{loaded} tickets checked, {updated} prices changed.")
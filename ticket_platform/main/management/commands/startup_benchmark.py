@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORT_SCRIPT = "import {wsgi_module}\nimport {urlconf}\n"
+
+
+def parse_importtime(output) -> dict:
+    """
+    Parse output of 'python -X importtime'.
+    :param output: stderr of python process.
+    :return: dictionary with module name: cumulative import time in microseconds.
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start of worker (WSGI application with all apps) and URLConf import with "
+        "'python -X importtime'. Fails if any of them exceed given threshold or if forbidden module is imported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-wsgi-ms', type=float, default=1500)
+        parser.add_argument('--max-urlconf-ms', type=float, default=300)
+        parser.add_argument('--repeat', type=int, default=3, help="Best result of given number of runs is taken.")
+        parser.add_argument(
+            '--forbid', nargs='*', default=['plotly', 'numpy'],
+            help="Modules, which shouldn't be imported during startup.",
+        )
+
+    def handle(self, *args, **options):
+        wsgi_module = settings.WSGI_APPLICATION.rsplit('.', 1)[0]
+        script = IMPORT_SCRIPT.format(wsgi_module=wsgi_module, urlconf=settings.ROOT_URLCONF)
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+
+        results = []
+        for _ in range(options['repeat']):
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', script], env=env, capture_output=True, text=True
+            )
+            if process.returncode:
+                raise CommandError(f"Startup failed:\n{process.stderr}")
+            results.append(parse_importtime(process.stderr))
+
+        wsgi_ms = min(result[wsgi_module] for result in results) / 1000
+        urlconf_ms = min(result[settings.ROOT_URLCONF] for result in results) / 1000
+        self.stdout.write(f"Worker cold start ({wsgi_module}): {wsgi_ms:.1f} ms.")
+        self.stdout.write(f"URLConf import ({settings.ROOT_URLCONF}): {urlconf_ms:.1f} ms.")
+
+        errors = []
+        if wsgi_ms > options['max_wsgi_ms']:
+            errors.append(f"Worker cold start {wsgi_ms:.1f} ms exceeds {options['max_wsgi_ms']} ms.")
+        if urlconf_ms > options['max_urlconf_ms']:
+            errors.append(f"URLConf import {urlconf_ms:.1f} ms exceeds {options['max_urlconf_ms']} ms.")
+        for module in options['forbid']:
+            if module in results[0]:
+                errors.append(f"Module '{module}' is imported during startup.")
+        if errors:
+            raise CommandError(" ".join(errors))
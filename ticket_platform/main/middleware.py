@@ -0,0 +1,41 @@
+from django.conf import settings
+
+from . import routers
+
+
+class BasketStorageMiddleware:
+    """
+    Let basket storage used during request update the response, e.g. set cookie with basket content.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        storage = getattr(request, '_basket_storage', None)
+        if storage is not None:
+            storage.update(response)
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin client which wrote to primary database to primary for 'REPLICA_PIN_SECONDS', so the client always reads its own
+    writes, even if replica is behind primary.
+    """
+    cookie_name = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start_request(pinned=self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            if routers.has_written():
+                response.set_cookie(
+                    self.cookie_name, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10), httponly=True
+                )
+        finally:
+            routers.start_request()
+        return response
@@ -1,7 +1,27 @@
-from django.db import models
-from django.db.models import F
+from django.db import models, transaction
+from django.db.models import F, Sum, Count, Q
+from django.db.models.functions import Upper
 from django.utils import timezone
 
+from .fragment_cache import bump_inventory_version
+from .sharding import get_shards, get_ticket_databases, shard_for_event
+
+
+class PatternOpsIndex(models.Index):
+    """
+    Functional index used by "LIKE 'prefix%'" queries. PostgreSQL uses such index only with pattern operator class
+    (unless database has C collation), so it is added there, other databases get plain index.
+    """
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+        from django.contrib.postgres.indexes import OpClass
+
+        index = models.Index(
+            *(OpClass(expression, name='text_pattern_ops') for expression in self.expressions), name=self.name
+        )
+        return index.create_sql(model, schema_editor, using=using, **kwargs)
+
 
 class Event(models.Model):
     """
@@ -10,10 +30,48 @@ class Event(models.Model):
     Fields:
         name - field with name of the event.
         time_and_date - field with date and time of event.
+        is_archived - information are all tickets of event already moved to archive.
+        lottery_closes_at - end of lottery entry window. If set, tickets are not reserved first-come, but allocated
+                            by lottery among entries collected until this time.
+        lottery_allocated - information is lottery of event already allocated, so rest of tickets is on sale.
     """
     name = models.CharField(max_length=30)
     time_and_date = models.DateTimeField()
     reservations = models.IntegerField(default=0)
+    is_archived = models.BooleanField(default=False)
+    lottery_closes_at = models.DateTimeField(null=True, blank=True)
+    lottery_allocated = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['time_and_date'], name='event_time_idx'),
+            models.Index(fields=['is_archived', 'time_and_date'], name='event_archived_time_idx'),
+            PatternOpsIndex(Upper('name'), name='event_name_upper_idx'),
+        ]
+
+    def save(self, *args, **kwargs) -> None:
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        bump_inventory_version(self.pk)
+        if adding:
+            PlatformTotals.add(events=1)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        PlatformTotals.add(events=-1)
+        return result
+
+    def is_lottery_pending(self) -> bool:
+        """
+        Give information if tickets of event are waiting for lottery allocation, so they couldn't be reserved.
+        """
+        return self.lottery_closes_at is not None and not self.lottery_allocated
+
+    def is_lottery_open(self) -> bool:
+        """
+        Give information if lottery entries are collected right now.
+        """
+        return self.is_lottery_pending() and timezone.now() < self.lottery_closes_at
 
     def increase_reservations_counter(self) -> None:
         """
@@ -36,11 +94,26 @@ class Event(models.Model):
         """
         return self.pk
 
-    def get_sum_of_available_tickets(self) -> int:
+    def get_snapshot_counts(self):
+        """
+        Get available tickets per category from availability snapshot.
+        :return: tuple with number of available tickets per category or None if database has to be asked.
         """
-        Count and get a sum of total available ticket sum for event.
+        # Snapshot is read with NumPy, which is heavy, so it is imported only when availability is really needed.
+        from .availability import get_available_counts
+        return get_available_counts(self.pk)
+
+    def get_sum_of_available_tickets(self, use_snapshot=True) -> int:
+        """
+        Count and get a sum of total available ticket sum for event. Fresh availability snapshot is used if there
+        is one, otherwise tickets are counted by database.
+        :param use_snapshot: if False, tickets are always counted by database (e.g. for value cached for longer
+                             than snapshot could be old).
         :return: Sum of available tickets.
         """
+        counts = self.get_snapshot_counts() if use_snapshot else None
+        if counts is not None:
+            return sum(counts)
         return self.ticket_set.filter(
             is_sold=False
         ).exclude(
@@ -49,12 +122,16 @@ class Event(models.Model):
 
     def get_available_tickets_num_by_categories(self) -> tuple:
         """
-        Count and get a amount of total available tickets per category for event.
+        Count and get a amount of total available tickets per category for event. Fresh availability snapshot is
+        used if there is one, otherwise tickets are counted by database.
         :return: Tuple with categories: sum of available ticket.
         """
+        counts = self.get_snapshot_counts()
+        if counts is not None:
+            return ((category[1], count) for category, count in zip(Ticket.CATEGORY, counts))
         return (
             (category[1], self.ticket_set.filter(
-                category=category[1],
+                category=category[0],
                 is_sold=False
             ).exclude(
                 reservation_time__gte=timezone.now()
@@ -73,30 +150,101 @@ class Order(models.Model):
     surname = models.CharField(max_length=30)
     time_and_date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['time_and_date'], name='order_time_idx'),
+        ]
+
+
+class Seat(models.Model):
+    """
+    Place on the venue, sold together with ticket of seated event. Seat is reused by every event on the venue
+    (with sharded inventory, seats are kept on every shard with events of the venue).
+
+    Fields:
+        section - name of venue section.
+        row - number of row within section, lower number is closer to the stage.
+        number - number of seat within row. Seats with consecutive numbers are next to each other.
+    """
+    section = models.CharField(max_length=10)
+    row = models.PositiveSmallIntegerField()
+    number = models.PositiveSmallIntegerField()
+
 
 class Ticket(models.Model):
     """
     Class with Ticket Model.
 
     Fields:
-        CATEGORY - constant list of tickets type.
+        CATEGORY - constant list of tickets type, as pairs of (stored code, displayed label).
+        CATEGORY_CODES - mapping of category label to its code.
         event - show us for what event ticket is.
-        category - char field with category selected according to CATEGORY field.
+        category - one char code of category selected according to CATEGORY field. Labels are used only for
+                   presentation (templates, urls, charts, exports).
         is_sold - information is ticket already sold.
         reservation_time - time until ticket will be lock for other users
         price - price of ticket in decimal
+        base_price - price before first automatic repricing, used as base of every next repricing.
+        seat - optional seat, sold together with ticket. Seats of venue are shared by all its events, every seat
+               could have only one ticket per event.
+
+    With sharded inventory ticket is kept on shard of its event, so relations to catalog tables (event, order)
+    are not enforced by database.
     """
     CATEGORY = (
         ("N", "Normal"),
         ("P", "Premium"),
         ("V", "VIP")
     )
-    event = models.ForeignKey(to=Event, on_delete=models.PROTECT)
-    order = models.ForeignKey(to=Order, on_delete=models.PROTECT, null=True)
-    category = models.CharField(max_length=10, choices=CATEGORY, default="Normal")
+    CATEGORY_CODES = {label: code for code, label in CATEGORY}
+    event = models.ForeignKey(to=Event, on_delete=models.PROTECT, db_constraint=False)
+    order = models.ForeignKey(to=Order, on_delete=models.PROTECT, null=True, db_constraint=False)
+    category = models.CharField(max_length=1, choices=CATEGORY, default="N")
     is_sold = models.BooleanField(default=False)
     reservation_time = models.DateTimeField(default=timezone.now())
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    base_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    seat = models.ForeignKey(to=Seat, on_delete=models.PROTECT, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'seat'], name='unique_ticket_seat_per_event'),
+        ]
+        indexes = [
+            models.Index(fields=['event', 'is_sold', 'reservation_time'], name='ticket_availability_idx'),
+            models.Index(fields=['is_sold', 'reservation_time'], name='ticket_status_idx'),
+            models.Index(fields=['category', 'id'], name='ticket_category_idx'),
+        ]
+
+    def save(self, *args, **kwargs) -> None:
+        adding = self._state.adding
+        shard = shard_for_event(self.event_id)
+        if shard:
+            kwargs['using'] = shard
+            if adding and self.pk is None:
+                self.pk = TicketIdSequence.allocate(shard)[0]
+                kwargs.setdefault('force_insert', True)
+        super().save(*args, **kwargs)
+        bump_inventory_version(self.event_id)
+        if adding:
+            PlatformTotals.add(**self._get_totals(sign=1))
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        PlatformTotals.add(**self._get_totals(sign=-1))
+        return result
+
+    def _get_totals(self, sign) -> dict:
+        """
+        Get contribution of ticket to platform totals.
+        :param sign: 1 if ticket is added, -1 if removed.
+        """
+        return {
+            'tickets': sign,
+            'possible_profit': sign * self.price,
+            'sold_tickets': sign * self.is_sold,
+            'profit': sign * self.price * self.is_sold,
+        }
 
     def reserve(self, minutes=15) -> None:
         """
@@ -129,3 +277,238 @@ class Ticket(models.Model):
         self.is_sold = True
         self.order = order
         self.release()
+
+
+class ArchivedOrder(models.Model):
+    """
+    Order of past event moved from Order table by 'archive_events' command. Original id is preserved.
+    """
+    id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=30)
+    surname = models.CharField(max_length=30)
+    time_and_date = models.DateTimeField()
+
+
+class ArchivedTicket(models.Model):
+    """
+    Ticket of past event moved from Ticket table by 'archive_events' command. Original id is preserved.
+    Relations are kept as plain ids, so archive could be stored in separate database.
+    """
+    id = models.IntegerField(primary_key=True)
+    event_id = models.IntegerField(db_index=True)
+    order_id = models.IntegerField(null=True)
+    category = models.CharField(max_length=1, choices=Ticket.CATEGORY)
+    is_sold = models.BooleanField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+class EventArchiveSummary(models.Model):
+    """
+    Precomputed totals of archived tickets for event, used by stats instead of scanning archive.
+
+    Fields:
+        total_tickets - number of archived tickets.
+        sold_tickets - number of archived sold tickets.
+        profit - sum of prices of archived sold tickets.
+        possible_profit - sum of prices of all archived tickets.
+    """
+    event = models.OneToOneField(to=Event, on_delete=models.PROTECT, related_name='archive_summary')
+    total_tickets = models.IntegerField(default=0)
+    sold_tickets = models.IntegerField(default=0)
+    profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    possible_profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+
+class DailySales(models.Model):
+    """
+    Daily rollup of sales, maintained within checkout transaction. Used by charts instead of scanning orders.
+
+    Fields:
+        date - day of sale.
+        category - category of sold tickets. Row with empty category (ALL_CATEGORIES) keeps totals of the day.
+        orders - number of orders.
+        tickets_sold - number of sold tickets.
+        revenue - sum of prices of sold tickets.
+    """
+    ALL_CATEGORIES = ""
+    date = models.DateField()
+    category = models.CharField(max_length=1, choices=Ticket.CATEGORY, blank=True)
+    orders = models.IntegerField(default=0)
+    tickets_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='unique_daily_sales_per_category'),
+        ]
+
+
+class PlatformTotals(models.Model):
+    """
+    Single row with global totals shown in stats footer, so they don't need scan of Ticket table. Row is updated on
+    creation and removal of events and tickets, on sale and on archival. Bulk operations, which omit model methods,
+    have to update it on their own or rebuild it with 'rebuild_platform_totals' command.
+
+    Fields:
+        events - number of events.
+        tickets - number of tickets, including archived ones.
+        sold_tickets - number of sold tickets, including archived ones.
+        profit - sum of prices of sold tickets.
+        possible_profit - sum of prices of all tickets.
+        archived_tickets - number of tickets moved to archive.
+    """
+    events = models.IntegerField(default=0)
+    tickets = models.IntegerField(default=0)
+    sold_tickets = models.IntegerField(default=0)
+    profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    possible_profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    archived_tickets = models.IntegerField(default=0)
+
+    TOTALS_ID = 1
+
+    @classmethod
+    def get(cls):
+        """
+        Get totals row. Row is rebuilt from scratch if it doesn't exist yet.
+        :return: PlatformTotals object.
+        """
+        try:
+            return cls.objects.get(pk=cls.TOTALS_ID)
+        except cls.DoesNotExist:
+            return cls.rebuild()
+
+    @classmethod
+    def add(cls, **deltas) -> None:
+        """
+        Add given values to totals, with single update query.
+        :param deltas: field name: value to add.
+        """
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not deltas:
+            return
+        updated = cls.objects.filter(pk=cls.TOTALS_ID).update(
+            **{field: F(field) + value for field, value in deltas.items()}
+        )
+        if not updated:
+            cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Count all totals from Event and Ticket tables (on every shard) and archive summaries.
+        :return: PlatformTotals object.
+        """
+        live = {'tickets': 0, 'sold_tickets': 0, 'profit': 0, 'possible_profit': 0}
+        for database in get_ticket_databases():
+            shard_totals = Ticket.objects.using(database).aggregate(
+                tickets=Count('id'),
+                sold_tickets=Count('id', filter=Q(is_sold=True)),
+                profit=Sum('price', filter=Q(is_sold=True), default=0),
+                possible_profit=Sum('price', default=0),
+            )
+            live = {field: live[field] + shard_totals[field] for field in live}
+        archived = EventArchiveSummary.objects.aggregate(
+            tickets=Sum('total_tickets', default=0),
+            sold_tickets=Sum('sold_tickets', default=0),
+            profit=Sum('profit', default=0),
+            possible_profit=Sum('possible_profit', default=0),
+        )
+        totals, _ = cls.objects.update_or_create(pk=cls.TOTALS_ID, defaults={
+            'events': Event.objects.count(),
+            'archived_tickets': archived['tickets'],
+            **{field: live[field] + archived[field] for field in live},
+        })
+        return totals
+
+
+class TicketIdSequence(models.Model):
+    """
+    Source of ticket ids when inventory is sharded. Single row on catalog database counts allocated slots, ticket
+    id is 'slot * number of shards + shard index', so it is unique on all shards and points to its shard.
+
+    Fields:
+        next_slot - first slot which wasn't allocated yet.
+    """
+    next_slot = models.BigIntegerField(default=1)
+
+    SEQUENCE_ID = 1
+
+    @classmethod
+    def allocate(cls, shard, count=1) -> list:
+        """
+        Allocate ids for new tickets on given shard.
+        :param shard: alias of shard database.
+        :param count: number of ids.
+        :return: list with ticket ids.
+        """
+        shards = get_shards()
+        with transaction.atomic():
+            cls.objects.get_or_create(pk=cls.SEQUENCE_ID)
+            cls.objects.filter(pk=cls.SEQUENCE_ID).update(next_slot=F('next_slot') + count)
+            next_slot = cls.objects.get(pk=cls.SEQUENCE_ID).next_slot
+        return [slot * len(shards) + shards.index(shard) for slot in range(next_slot - count, next_slot)]
+
+
+class BoxOfficeRequest(models.Model):
+    """
+    Purchase made through box office API, stored under idempotency key given by client. Repeated request with the
+    same key gets stored response instead of buying tickets again.
+
+    Fields:
+        key - idempotency key.
+        fingerprint - hash of request body, the same key couldn't be used for different purchase.
+        order - order created by request, cleared when order is archived (response keeps its data).
+        response - response body returned to client.
+        created - time of request.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    order = models.OneToOneField(to=Order, on_delete=models.SET_NULL, null=True)
+    response = models.JSONField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class LotteryEntry(models.Model):
+    """
+    Request for tickets of lottery event, collected during entry window. Entries are only inserted until allocation,
+    which marks them as won (with held tickets) or lost in one pass.
+
+    Fields:
+        event - lottery event.
+        entrant - session key of buyer, won tickets are added to basket of this session.
+        category - code of requested ticket category.
+        quantity - number of requested tickets, entry wins all of them or nothing.
+        weight - chance of entry relative to other entries in weighted allocation, positive. Entries get inverse
+                 of their quantity, so in weighted allocation every requested ticket has the same chance.
+        status - pending, won, lost or claimed (won tickets were added to basket).
+        ticket_ids - ids of tickets held for won entry.
+        created - time of entry.
+    """
+    PENDING = "P"
+    WON = "W"
+    LOST = "L"
+    CLAIMED = "C"
+    STATUS = (
+        (PENDING, "Pending"),
+        (WON, "Won"),
+        (LOST, "Lost"),
+        (CLAIMED, "Claimed"),
+    )
+    event = models.ForeignKey(to=Event, on_delete=models.PROTECT)
+    entrant = models.CharField(max_length=40)
+    category = models.CharField(max_length=1, choices=Ticket.CATEGORY)
+    quantity = models.PositiveSmallIntegerField(default=1)
+    weight = models.FloatField(default=1.0)
+    status = models.CharField(max_length=1, choices=STATUS, default=PENDING)
+    ticket_ids = models.JSONField(default=list, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'entrant'], name='unique_lottery_entry_per_entrant'),
+            models.CheckConstraint(condition=Q(weight__gt=0), name='lottery_entry_weight_positive'),
+        ]
+        indexes = [
+            models.Index(fields=['entrant', 'status'], name='lottery_entrant_idx'),
+            models.Index(fields=['event', 'status'], name='lottery_event_idx'),
+        ]
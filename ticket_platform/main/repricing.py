@@ -0,0 +1,162 @@
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, Count, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Event, Ticket, PlatformTotals
+
+RepricingRule = namedtuple("RepricingRule", (
+    "demand_weight", "sell_through_weight", "urgency_weight", "urgency_days", "min_factor", "max_factor",
+))
+
+DEFAULT_RULE = RepricingRule(
+    demand_weight=0.1,
+    sell_through_weight=0.5,
+    urgency_weight=0.2,
+    urgency_days=7,
+    min_factor=0.5,
+    max_factor=2.0,
+)
+
+
+def get_repricing_rules() -> dict:
+    """
+    Get repricing rule for each ticket category. Rules could be overwritten by 'REPRICING_RULES' setting, where
+    category code (or 'default') is mapped to dictionary with RepricingRule fields.
+    :return: dictionary with category code: RepricingRule.
+    """
+    configured = getattr(settings, 'REPRICING_RULES', {})
+    default = DEFAULT_RULE._replace(**configured.get('default', {}))
+    return {code: default._replace(**configured.get(code, {})) for code, _ in Ticket.CATEGORY}
+
+
+class RepricingEngine:
+    """
+    Compute new prices of unsold tickets from demand signals of their event and category:
+        demand - number of reservation clicks per ticket of event,
+        sell through - part of tickets in category which is already sold,
+        urgency - grows from 0 to 1 during last 'urgency_days' before event.
+    New price is base price multiplied by '1 + weights * signals', limited to (min_factor, max_factor).
+    Whole inventory is kept in NumPy arrays, so calculation is vectorized, and changes are written back with
+    one update per batch of tickets.
+    """
+    def __init__(self, rules=None, now=None) -> None:
+        self.rules = rules or get_repricing_rules()
+        self.now = now or timezone.now()
+        self.categories = [code for code, _ in Ticket.CATEGORY]
+        self.ticket_ids = np.empty(0, dtype=np.int64)
+        self.prices = np.empty(0, dtype=np.int64)
+        self.base_prices = np.empty(0, dtype=np.int64)
+        self.event_ids = np.empty(0, dtype=np.int64)
+        self.category_indexes = np.empty(0, dtype=np.int64)
+
+    def _get_available_tickets(self, event_ids=None):
+        tickets = Ticket.objects.filter(
+            is_sold=False, reservation_time__lt=self.now, event__time_and_date__gt=self.now
+        )
+        if event_ids is not None:
+            tickets = tickets.filter(event_id__in=event_ids)
+        return tickets
+
+    def load(self, event_ids=None) -> int:
+        """
+        Load unsold and not held tickets of future events into arrays. Prices are kept as integer cents.
+        :param event_ids: optional list of events to reprice, all future events by default.
+        :return: number of loaded tickets.
+        """
+        category_indexes = {code: index for index, code in enumerate(self.categories)}
+        rows = self._get_available_tickets(event_ids).values_list(
+            'id', 'event_id', 'category', 'price', 'base_price'
+        ).iterator(chunk_size=10000)
+        data = np.array([
+            (ticket_id, event_id, category_indexes[category], int(price * 100), int((base_price or price) * 100))
+            for ticket_id, event_id, category, price, base_price in rows
+        ], dtype=np.int64).reshape(-1, 5)
+        self.ticket_ids, self.event_ids, self.category_indexes, self.prices, self.base_prices = data.T
+        return len(self.ticket_ids)
+
+    def _get_signals(self) -> tuple:
+        """
+        Calculate demand signals for each loaded ticket.
+        :return: tuple of arrays (demand, sell through, days to event), aligned with loaded tickets.
+        """
+        events, event_positions = np.unique(self.event_ids, return_inverse=True)
+        groups = np.zeros((len(events), len(self.categories), 2))
+        event_indexes = {event_id: index for index, event_id in enumerate(events.tolist())}
+        for row in Ticket.objects.filter(event_id__in=event_indexes).values('event_id', 'category').annotate(
+            total=Count('id'), sold=Count('id', filter=Q(is_sold=True))
+        ):
+            groups[event_indexes[row['event_id']], self.categories.index(row['category'])] = row['total'], row['sold']
+
+        reservations = np.zeros(len(events))
+        days_to_event = np.zeros(len(events))
+        for event_id, event_reservations, time_and_date in Event.objects.filter(
+            id__in=event_indexes
+        ).values_list('id', 'reservations', 'time_and_date'):
+            reservations[event_indexes[event_id]] = event_reservations
+            days_to_event[event_indexes[event_id]] = (time_and_date - self.now).total_seconds() / 86400
+
+        tickets_per_event = np.maximum(groups[:, :, 0].sum(axis=1), 1)
+        sell_through = groups[:, :, 1] / np.maximum(groups[:, :, 0], 1)
+        return (
+            (reservations / tickets_per_event)[event_positions],
+            sell_through[event_positions, self.category_indexes],
+            days_to_event[event_positions],
+        )
+
+    def compute(self):
+        """
+        Compute new prices of loaded tickets.
+        :return: array with new prices in cents.
+        """
+        if not len(self.ticket_ids):
+            return np.empty(0, dtype=np.int64)
+        rule_values = np.array([self.rules[code] for code in self.categories], dtype=float)
+        rules = {field: rule_values[self.category_indexes, index] for index, field in enumerate(RepricingRule._fields)}
+        demand, sell_through, days_to_event = self._get_signals()
+        urgency = np.clip(1 - days_to_event / rules['urgency_days'], 0, 1)
+        factors = np.clip(
+            1 + rules['demand_weight'] * demand + rules['sell_through_weight'] * sell_through
+            + rules['urgency_weight'] * urgency,
+            rules['min_factor'],
+            rules['max_factor'],
+        )
+        return np.rint(self.base_prices * factors).astype(np.int64)
+
+    def apply(self, new_prices, batch_size=5000) -> int:
+        """
+        Write changed prices to database, with one update per batch of tickets. Tickets are sorted by new price,
+        so each batch sets price with single CASE of few price groups. Each update is limited to tickets which are
+        still unsold and not held, so tickets reserved meanwhile are never touched.
+        :param new_prices: array with new prices in cents, as returned by 'compute' method.
+        :param batch_size: maximal number of tickets changed by single update.
+        :return: number of changed tickets.
+        """
+        changed = new_prices != self.prices
+        order = np.argsort(new_prices[changed], kind='stable')
+        changed_ids = self.ticket_ids[changed][order]
+        changed_prices = new_prices[changed][order]
+        price_differences = (new_prices - self.prices)[changed][order]
+        updated, possible_profit, complete = 0, 0, True
+        now = timezone.now()
+        for start in range(0, len(changed_ids), batch_size):
+            batch = changed_ids[start:start + batch_size]
+            prices, boundaries = np.unique(changed_prices[start:start + batch_size], return_index=True)
+            batch_updated = Ticket.objects.filter(
+                id__in=batch.tolist(), is_sold=False, reservation_time__lt=now
+            ).update(base_price=Coalesce('base_price', 'price'), price=Case(*(
+                When(id__in=ids.tolist(), then=Value(Decimal(price) / 100))
+                for price, ids in zip(prices.tolist(), np.split(batch, boundaries[1:]))
+            )))
+            updated += batch_updated
+            complete = complete and batch_updated == len(batch)
+            possible_profit += int(price_differences[start:start + batch_size].sum())
+        if complete:
+            PlatformTotals.add(possible_profit=Decimal(possible_profit) / 100)
+        else:
+            PlatformTotals.rebuild()
+        return updated
@@ -0,0 +1,91 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedTicket, DailySales, Order, Ticket
+from .sharding import get_shards
+
+
+def record_sale(order, tickets) -> None:
+    """
+    Add sold tickets of order to daily rollup. Should be launched within checkout transaction.
+    :param order: Order object.
+    :param tickets: list of Ticket objects sold within order. Nothing is recorded if it is empty.
+    """
+    if not tickets:
+        return
+    date = timezone.localdate(order.time_and_date)
+    rows = {DailySales.ALL_CATEGORIES: {'tickets_sold': 0, 'revenue': 0}}
+    for ticket in tickets:
+        for category in (DailySales.ALL_CATEGORIES, ticket.category):
+            row = rows.setdefault(category, {'tickets_sold': 0, 'revenue': 0})
+            row['tickets_sold'] += 1
+            row['revenue'] += ticket.price
+
+    for category, values in rows.items():
+        DailySales.objects.get_or_create(date=date, category=category)
+        DailySales.objects.filter(date=date, category=category).update(
+            orders=F('orders') + 1,
+            tickets_sold=F('tickets_sold') + values['tickets_sold'],
+            revenue=F('revenue') + values['revenue'],
+        )
+
+
+def rebuild_daily_sales() -> int:
+    """
+    Recreate whole daily rollup from orders and tickets, archived ones included. Archived ticket could belong to
+    archived order, or to order still having tickets of future events, so order of category is counted once
+    when its tickets are split between archive and Ticket table. Rollup is built with joins of orders and tickets,
+    so it couldn't be rebuilt when inventory is sharded.
+    :return: number of created rows.
+    """
+    if get_shards():
+        raise ImproperlyConfigured("Daily sales rollup couldn't be rebuilt when 'TICKET_SHARDS' setting is used.")
+    rows = {}
+
+    def get_row(date, category) -> DailySales:
+        return rows.setdefault((date, category), DailySales(date=date, category=category))
+
+    for orders in (Order.objects, ArchivedOrder.objects):
+        for date, count in orders.annotate(
+            date=TruncDate('time_and_date')
+        ).values_list('date').annotate(Count('id')).order_by():
+            get_row(date, DailySales.ALL_CATEGORIES).orders += count
+
+    for category, _ in Ticket.CATEGORY:
+        archived_tickets = Exists(ArchivedTicket.objects.filter(order_id=OuterRef('pk'), category=category))
+        for orders in (
+            Order.objects.filter(Q(Exists(Ticket.objects.filter(order=OuterRef('pk'), category=category))) | Q(
+                archived_tickets
+            )),
+            ArchivedOrder.objects.filter(archived_tickets),
+        ):
+            for date, count in orders.annotate(
+                date=TruncDate('time_and_date')
+            ).values_list('date').annotate(Count('id')).order_by():
+                get_row(date, category).orders += count
+
+    archived_order_time = Coalesce(
+        Subquery(Order.objects.filter(id=OuterRef('order_id')).values('time_and_date')),
+        Subquery(ArchivedOrder.objects.filter(id=OuterRef('order_id')).values('time_and_date')),
+    )
+    for tickets in (
+        Ticket.objects.filter(order__isnull=False).annotate(date=TruncDate('order__time_and_date')),
+        ArchivedTicket.objects.filter(order_id__isnull=False).annotate(date=TruncDate(archived_order_time)),
+    ):
+        for date, category, tickets_sold, revenue in tickets.values_list('date', 'category').annotate(
+            Count('id'), Sum('price')
+        ).order_by():
+            if date is None:
+                continue
+            for row_category in (DailySales.ALL_CATEGORIES, category):
+                row = get_row(date, row_category)
+                row.tickets_sold += tickets_sold
+                row.revenue += revenue
+
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailySales.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
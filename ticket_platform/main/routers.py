@@ -0,0 +1,127 @@
+"""
+Database routers for ticket platform.
+
+TicketShardRouter keep tickets and seats of every event on its shard (see 'main.sharding'). It has to be listed
+before PrimaryReplicaRouter, which then routes all remaining models.
+
+PrimaryReplicaRouter send reads made within 'replica_reads' block (reporting and catalog views) to one of databases
+listed in 'DATABASE_REPLICAS' setting. All other reads and all writes (reservations, checkout) use 'default'
+database. Example configuration with two local SQLite databases:
+
+    DATABASES = {
+        'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'primary.sqlite3'},
+        'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.sqlite3',
+                    'TEST': {'MIRROR': 'default'}},
+    }
+    DATABASE_REPLICAS = ['replica']
+    DATABASE_ROUTERS = ['main.routers.PrimaryReplicaRouter']
+    MIDDLEWARE += ['main.middleware.ReplicaPinningMiddleware']
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .sharding import get_shards, shard_for_event
+
+_state = threading.local()
+
+
+def get_replicas() -> list:
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def replica_reads():
+    """
+    Allow reads within block to be served by replica. Could be used as view decorator as well.
+    """
+    previous = getattr(_state, 'use_replica', False)
+    _state.use_replica = True
+    try:
+        yield
+    finally:
+        _state.use_replica = previous
+
+
+def start_request(pinned=False) -> None:
+    """
+    Reset routing state at the beginning of request.
+    :param pinned: if True, all reads will use primary database ("read your writes" for session which just wrote).
+    """
+    _state.pinned = pinned
+    _state.wrote = False
+
+
+def has_written() -> bool:
+    """
+    Give information if anything was written to primary database during current request.
+    """
+    return getattr(_state, 'wrote', False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Router which send reporting and catalog reads to replica and keep everything else on primary database.
+    """
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or not getattr(_state, 'use_replica', False):
+            return 'default'
+        if getattr(_state, 'pinned', False) or has_written():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
+
+
+class TicketShardRouter:
+    """
+    Router which send tickets and seats to shard of their event. Shard is taken from hints - object passed to
+    query (event for 'event.ticket_set', ticket for its 'save' and related objects). Queries without such hint
+    are left to next router, so they have to choose shard with 'using()' on their own.
+    """
+    sharded_models = ('main.ticket', 'main.seat')
+
+    def _get_shard(self, model, hints):
+        if model._meta.label_lower not in self.sharded_models or not get_shards():
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if instance._state.db in get_shards():
+            return instance._state.db
+        label = instance._meta.label_lower
+        if label == 'main.event':
+            return shard_for_event(instance.pk)
+        if label == 'main.ticket':
+            return shard_for_event(instance.event_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._get_shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._get_shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = get_shards()
+        if not shards:
+            return None
+        if f"{app_label}.{model_name}" in self.sharded_models:
+            return db in shards
+        if db in shards:
+            return False
+        return None
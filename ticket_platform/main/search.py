@@ -0,0 +1,79 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from .models import Event, Ticket
+from .sharding import get_shards
+
+
+def use_trigram_search() -> bool:
+    """
+    Trigram search needs PostgreSQL with 'pg_trgm' extension and 'django.contrib.postgres' app. It is enabled by
+    'EVENT_SEARCH_TRIGRAM' setting, together with GIN index created on database:
+        CREATE INDEX main_event_name_trgm_idx ON main_event USING gin (name gin_trgm_ops);
+    """
+    return (
+        getattr(settings, 'EVENT_SEARCH_TRIGRAM', False)
+        and connection.vendor == 'postgresql'
+        and 'django.contrib.postgres' in settings.INSTALLED_APPS
+    )
+
+
+def filter_by_name(events, query):
+    """
+    Filter events by name. Names starting with query are found on every database, compared in upper case, so
+    the query could use 'event_name_upper_idx' index. On PostgreSQL with trigram search enabled also names similar
+    to query are found, best matches first.
+    :param events: Event queryset.
+    :param query: searched text.
+    :return: filtered queryset.
+    """
+    events = events.alias(name_upper=Upper('name'))
+    if not use_trigram_search():
+        return events.filter(name_upper__startswith=query.upper())
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    return events.annotate(
+        similarity=TrigramSimilarity('name', query)
+    ).filter(
+        Q(name_upper__startswith=query.upper()) | Q(name__trigram_similar=query)
+    ).order_by('-similarity', '-time_and_date')
+
+
+def search_events(q="", date_from=None, date_to=None, available=False):
+    """
+    Get future events matching search criteria. Every filter is backed by index of Event or Ticket table (similar
+    names found by trigram search need GIN index described in 'use_trigram_search').
+    :param q: beginning of event name, empty for all events.
+    :param date_from: first day of events.
+    :param date_to: last day of events, included.
+    :param available: if True, only events with at least one free ticket are returned. With sharded inventory
+                      ids of such events are collected from every shard.
+    :return: Event queryset, sorted by time.
+    """
+    now = timezone.now()
+    events = Event.objects.filter(time_and_date__gt=now).order_by('-time_and_date')
+    if date_from:
+        events = events.filter(time_and_date__gte=_start_of_day(date_from))
+    if date_to:
+        events = events.filter(time_and_date__lt=_start_of_day(date_to + datetime.timedelta(days=1)))
+    if available:
+        free_tickets = Ticket.objects.filter(is_sold=False, reservation_time__lt=now)
+        if get_shards():
+            events = events.filter(id__in=[
+                event_id for database in get_shards()
+                for event_id in free_tickets.using(database).values_list('event_id', flat=True).distinct()
+            ])
+        else:
+            events = events.filter(Exists(free_tickets.filter(event=OuterRef('pk'))))
+    if q:
+        events = filter_by_name(events, q)
+    return events
+
+
+def _start_of_day(date) -> datetime.datetime:
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
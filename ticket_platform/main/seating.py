@@ -0,0 +1,152 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .fragment_cache import bump_inventory_version
+from .models import Ticket
+from .sharding import shard_for_event
+
+ALLOCATION_ATTEMPTS = 3
+
+_seat_maps = {}
+_seat_maps_lock = threading.Lock()
+
+
+class SeatMap:
+    """
+    In-memory availability of seats for single event and category. Every row is kept as integer bitmap, where bit
+    with seat number is set if seat is free, so block of N free seats next to each other is found with a few bit
+    operations per row.
+    """
+    def __init__(self, seats) -> None:
+        """
+        :param seats: iterable with (ticket id, section, row, number, is free) tuples.
+        """
+        self.lock = threading.Lock()
+        self.loaded_at = time.monotonic()
+        self.free = {}
+        self.centers = {}
+        self.ticket_ids = {}
+        self.positions = {}
+        all_seats = {}
+        for ticket_id, section, row, number, is_free in seats:
+            key = (row, section)
+            self.ticket_ids.setdefault(key, {})[number] = ticket_id
+            self.positions[ticket_id] = (key, number)
+            all_seats[key] = all_seats.get(key, 0) | 1 << number
+            self.free[key] = self.free.get(key, 0) | is_free << number
+        for key, seats_bitmap in all_seats.items():
+            first_number = (seats_bitmap & -seats_bitmap).bit_length() - 1
+            last_number = seats_bitmap.bit_length() - 1
+            self.centers[key] = (first_number + last_number) / 2
+
+    @classmethod
+    def load(cls, event_id, category):
+        """
+        Build seat map from database.
+        :param event_id: id of event.
+        :param category: code of ticket category.
+        :return: SeatMap object.
+        """
+        now = timezone.now()
+        tickets = Ticket.objects.using(shard_for_event(event_id)).filter(
+            event_id=event_id, category=category, seat__isnull=False
+        ).values_list('id', 'seat__section', 'seat__row', 'seat__number', 'is_sold', 'reservation_time')
+        return cls(
+            (ticket_id, section, row, number, not is_sold and reservation_time < now)
+            for ticket_id, section, row, number, is_sold, reservation_time in tickets
+        )
+
+    def find_best_block(self, quantity) -> list:
+        """
+        Find the best block of free seats next to each other. Rows closer to the stage are better, within row block
+        closest to the row center is taken.
+        :param quantity: number of seats.
+        :return: list with ticket ids of seats or None if there is no such block.
+        """
+        if quantity < 1:
+            return None
+        for key in sorted(self.free):
+            starts = self.free[key]
+            for _ in range(quantity - 1):
+                starts &= starts >> 1
+            if not starts:
+                continue
+            best_start, best_distance = None, None
+            while starts:
+                lowest = starts & -starts
+                start = lowest.bit_length() - 1
+                distance = abs(start + (quantity - 1) / 2 - self.centers[key])
+                if best_distance is None or distance < best_distance:
+                    best_start, best_distance = start, distance
+                starts ^= lowest
+            return [self.ticket_ids[key][number] for number in range(best_start, best_start + quantity)]
+        return None
+
+    def take(self, ticket_ids) -> None:
+        """
+        Mark seats of given tickets as taken.
+        """
+        for ticket_id in ticket_ids:
+            key, number = self.positions[ticket_id]
+            self.free[key] &= ~(1 << number)
+
+    def release(self, ticket_ids) -> None:
+        """
+        Mark seats of given tickets as free.
+        """
+        for ticket_id in ticket_ids:
+            if ticket_id in self.positions:
+                key, number = self.positions[ticket_id]
+                self.free[key] |= 1 << number
+
+
+def get_seat_map(event_id, category, refresh=False) -> SeatMap:
+    """
+    Get seat map kept in worker memory. Map is loaded again from database when it is older than 'SEAT_MAP_TTL'
+    seconds, because other workers and expired reservations change seats availability as well.
+    :param refresh: if True, map is always loaded from database.
+    """
+    key = (event_id, category)
+    seat_map = _seat_maps.get(key)
+    if refresh or seat_map is None or time.monotonic() - seat_map.loaded_at > getattr(settings, 'SEAT_MAP_TTL', 5):
+        seat_map = SeatMap.load(event_id, category)
+        with _seat_maps_lock:
+            _seat_maps[key] = seat_map
+    return seat_map
+
+
+def allocate_seats(event_id, category, quantity, minutes=15) -> list:
+    """
+    Find the best block of seats and hold their tickets for given time. Seats taken from in-memory map are held in
+    database with conditional update within transaction. If any of them was taken meanwhile by another worker,
+    transaction is rolled back and allocation is repeated with map loaded from database.
+    :param event_id: id of event.
+    :param category: code of ticket category.
+    :param quantity: number of seats next to each other.
+    :param minutes: time of reservation.
+    :return: list with ids of held tickets, empty if there is no such block of free seats.
+    """
+    for attempt in range(ALLOCATION_ATTEMPTS):
+        seat_map = get_seat_map(event_id, category, refresh=attempt > 0)
+        with seat_map.lock:
+            ticket_ids = seat_map.find_best_block(quantity)
+            if ticket_ids is None:
+                if attempt:
+                    break
+                continue
+            database = shard_for_event(event_id)
+            with transaction.atomic(using=database):
+                now = timezone.now()
+                held = Ticket.objects.using(database).filter(
+                    id__in=ticket_ids, is_sold=False, reservation_time__lt=now
+                ).update(reservation_time=now + timezone.timedelta(minutes=minutes))
+                if held == len(ticket_ids):
+                    seat_map.take(ticket_ids)
+                    bump_inventory_version(event_id)
+                    return ticket_ids
+                transaction.set_rollback(True)
+    return []
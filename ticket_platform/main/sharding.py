@@ -0,0 +1,67 @@
+"""
+Horizontal sharding of ticket inventory.
+
+Tickets (together with their seats and holds) of single event live on one of databases listed in 'TICKET_SHARDS'
+setting, chosen from event id. Events, orders and all reporting tables stay on 'default' (catalog) database.
+Ticket ids are unique across all shards and encode the shard, so basket with ticket ids only could be split by
+shard without any query. Number and order of shards could not be changed once tickets are created.
+Example configuration with several local SQLite databases:
+
+    DATABASES = {
+        'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'catalog.sqlite3'},
+        'tickets_0': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'tickets_0.sqlite3'},
+        'tickets_1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'tickets_1.sqlite3'},
+    }
+    TICKET_SHARDS = ['tickets_0', 'tickets_1']
+    DATABASE_ROUTERS = ['main.routers.TicketShardRouter', 'main.routers.PrimaryReplicaRouter']
+
+Without 'TICKET_SHARDS' all helpers return None as database alias, so queries are routed as usual.
+"""
+from django.conf import settings
+
+
+def get_shards() -> list:
+    return list(getattr(settings, 'TICKET_SHARDS', []))
+
+
+def get_ticket_databases() -> list:
+    """
+    Get all databases with tickets.
+    :return: list with shard aliases, or [None] if inventory is not sharded.
+    """
+    return get_shards() or [None]
+
+
+def shard_for_event(event_id):
+    """
+    Get database with tickets of given event.
+    :return: shard alias, None if inventory is not sharded.
+    """
+    shards = get_shards()
+    if not shards or event_id is None:
+        return None
+    return shards[int(event_id) % len(shards)]
+
+
+def shard_for_ticket(ticket_id):
+    """
+    Get database with given ticket. Shard is encoded in ticket id (see 'TicketIdSequence').
+    :return: shard alias, None if inventory is not sharded.
+    """
+    shards = get_shards()
+    if not shards:
+        return None
+    return shards[int(ticket_id) % len(shards)]
+
+
+def group_by_shard(ticket_ids) -> list:
+    """
+    Split ticket ids by shard. Shards are sorted, so every transaction touching many shards lock them in the same
+    order.
+    :param ticket_ids: iterable with ticket ids.
+    :return: list with (shard alias, list of ticket ids) tuples.
+    """
+    groups = {}
+    for ticket_id in ticket_ids:
+        groups.setdefault(shard_for_ticket(ticket_id), []).append(ticket_id)
+    return sorted(groups.items(), key=lambda group: group[0] or '')
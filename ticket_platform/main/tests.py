@@ -1,16 +1,43 @@
 import datetime
-from unittest import mock
-
-from django.http import HttpRequest
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpRequest, HttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from .availability import write_snapshot
 from .basket import Basket
-from .exceptions import NonExistingTicketToRemove
+from .basket_storage import get_basket_storage, SessionBasketStorage, CacheBasketStorage, SignedCookieBasketStorage
+from .exceptions import NonExistingTicketToRemove, PaymentAmountMismatch
 from .line_chart_plotter import LineChartAbstract, OrderPlotter
-from .models import Ticket, Event, Order
-from .views import event_list_view, event_detail_view
-from .utils import time_between, payment_error_message, turn_none_into_zero
+from .lottery import LOTTERY_SESSION_FLAG, allocate_lottery, draw_order
+from .middleware import ReplicaPinningMiddleware
+from .models import Ticket, Event, Order, DailySales, PlatformTotals, Seat, ArchivedTicket, ArchivedOrder, \
+    EventArchiveSummary, TicketIdSequence, LotteryEntry, BoxOfficeRequest
+from .repricing import RepricingEngine, DEFAULT_RULE
+from .rollup import rebuild_daily_sales
+from .routers import PrimaryReplicaRouter, TicketShardRouter, replica_reads
+from .search import search_events
+from .seating import SeatMap, allocate_seats, _seat_maps
+from .sharding import group_by_shard, shard_for_event, shard_for_ticket
+from .throttling import SlidingWindow, RateLimit
+from .views import event_list_view, event_detail_view, get_event_summary
+from .utils import time_between, payment_error_message, turn_none_into_zero, downsample_lttb
 
 
 class BaseSetUp(TestCase):
@@ -51,9 +78,9 @@ class EventObjectTest(BaseSetUp):
         self.assertEqual(self.test_event.get_sum_of_available_tickets(), 0)
 
     def test_get_sum_of_available_tickets_with_tickets(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0])
         self.assertEqual(self.test_event.get_sum_of_available_tickets(), 3)
 
     def test_get_available_tickets_num_by_categories_with_no_tickets(self):
@@ -63,18 +90,18 @@ class EventObjectTest(BaseSetUp):
         )
 
     def test_get_available_tickets_num_by_categories_with_tickets(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0])
         self.assertEqual(
             list(self.test_event.get_available_tickets_num_by_categories()),
             [("Normal", 1), ("Premium", 1), ("VIP", 1)]
         )
 
     def test_get_available_tickets_num_by_categories_if_one_is_reserved(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0])
         Ticket.objects.last().reserve()
 
         self.assertEqual(
@@ -85,6 +112,7 @@ class EventObjectTest(BaseSetUp):
 
 class ListOfEventViewTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.test_datetime = timezone.now()
         session = self.client.get("/")
         self.request = HttpRequest()
@@ -110,6 +138,15 @@ class ListOfEventViewTest(TestCase):
         response = self.client.get("/")
         self.assertEqual(response.status_code, 200)
 
+    def test_event_cards_are_cached_until_inventory_changes(self):
+        event = Event.objects.create(name="Test Event", time_and_date=self.test_datetime + timezone.timedelta(days=1))
+        ticket = Ticket.objects.create(event=event)
+        self.assertTrue("Available tickets: 1" in event_list_view(self.request).content.decode())
+        with self.assertNumQueries(1):
+            self.assertTrue("Available tickets: 1" in event_list_view(self.request).content.decode())
+        ticket.reserve()
+        self.assertTrue("SOLD OUT!" in event_list_view(self.request).content.decode())
+
     def test_main_view_with_two_events_including_one_from_past(self):
         Event.objects.create(name="Test Event Future", time_and_date=timezone.now() + timezone.timedelta(days=1))
         Event.objects.create(name="Test Event Past", time_and_date=timezone.now() - timezone.timedelta(days=1))
@@ -118,6 +155,54 @@ class ListOfEventViewTest(TestCase):
         self.assertTrue("Event name: Test Event Future." in decoded_response)
         self.assertFalse("Event name: Test Event Past." in decoded_response)
 
+    def test_search_by_name_date_range_and_availability(self):
+        tomorrow = self.test_datetime + timezone.timedelta(days=1)
+        concert = Event.objects.create(name="Rock Concert", time_and_date=tomorrow)
+        Event.objects.create(name="Rock Festival", time_and_date=tomorrow + timezone.timedelta(days=10))
+        Event.objects.create(name="Opera", time_and_date=tomorrow)
+        Ticket.objects.create(event=concert)
+        content = self.client.get("/", {"q": "rock"}).content.decode()
+        self.assertTrue("Rock Concert" in content and "Rock Festival" in content)
+        self.assertFalse("Opera" in content)
+        content = self.client.get("/", {"q": "rock", "date_to": tomorrow.date() + datetime.timedelta(days=1)})
+        self.assertFalse("Rock Festival" in content.content.decode())
+        content = self.client.get("/", {"available": "on"}).content.decode()
+        self.assertTrue("Rock Concert" in content)
+        self.assertFalse("Opera" in content or "Rock Festival" in content)
+
+    def test_search_applies_valid_filters_of_invalid_form(self):
+        tomorrow = self.test_datetime + timezone.timedelta(days=1)
+        Event.objects.create(name="Rock Concert", time_and_date=tomorrow)
+        Event.objects.create(name="Rock Festival", time_and_date=tomorrow + timezone.timedelta(days=10))
+        content = self.client.get("/", {"q": "r" * 31, "date_to": tomorrow.date()}).content.decode()
+        self.assertTrue("Rock Concert" in content)
+        self.assertFalse("Rock Festival" in content)
+        self.assertTrue("at most 30 characters" in content)
+        content = self.client.get("/", {
+            "q": "rock", "date_from": tomorrow.date(), "date_to": self.test_datetime.date()
+        }).content.decode()
+        self.assertTrue("Rock Concert" in content and "Rock Festival" in content)
+        self.assertTrue("Start date must be before end date." in content)
+
+    def test_search_by_name_uses_upper_case_index(self):
+        self.assertIn('UPPER("main_event"."name") LIKE', str(search_events(q="rock").query))
+        index = next(index for index in Event._meta.indexes if index.name == 'event_name_upper_idx')
+        schema_editor = connection.schema_editor()
+        self.assertIn('UPPER("name")', str(index.create_sql(Event, schema_editor)))
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertIn('UPPER("name") text_pattern_ops', str(index.create_sql(Event, schema_editor)))
+
+    @override_settings(EVENTS_PER_PAGE=2)
+    def test_event_list_is_paginated(self):
+        for day in range(1, 4):
+            Event.objects.create(name=f"Event {day}", time_and_date=self.test_datetime + timezone.timedelta(days=day))
+        response = self.client.get("/")
+        self.assertEqual(len(response.context['events']), 2)
+        self.assertEqual(response.context['next_page'], 2)
+        response = self.client.get("/", {"page": 2})
+        self.assertEqual([e.event.name for e in response.context['events']], ["Event 1"])
+        self.assertIsNone(response.context['next_page'])
+
 
 class EventDetailViewTest(BaseSetUp):
     def setUp(self):
@@ -136,9 +221,9 @@ class EventDetailViewTest(BaseSetUp):
         self.assertTrue("Detail for Test Event." in decoded_response)
 
     def test_detail_view_content_with_tickets_positive_scenario(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0])
         response = event_detail_view(self.request, self.test_event.id)
         decoded_response = response.content.decode()
         self.assertTrue("Detail for Test Event." in decoded_response)
@@ -149,9 +234,9 @@ class EventDetailViewTest(BaseSetUp):
         self.assertEqual(decoded_response.count("Reserve"), 3)
 
     def test_detail_view_content_with_tickets_if_one_types_of_tickets_non_exist(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1], is_sold=True)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0], is_sold=True)
         response = event_detail_view(self.request, self.test_event.id)
         decoded_response = response.content.decode()
         self.assertEqual(decoded_response.count("Reserve"), 2)
@@ -160,8 +245,8 @@ class EventDetailViewTest(BaseSetUp):
         self.assertFalse("VIP: 0" in decoded_response)
 
     def test_detail_view_content_with_tickets_if_one_types_of_tickets_sold_out(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
         response = event_detail_view(self.request, self.test_event.id)
         decoded_response = response.content.decode()
         self.assertEqual(decoded_response.count("Reserve"), 2)
@@ -170,9 +255,9 @@ class EventDetailViewTest(BaseSetUp):
         self.assertFalse("VIP: 0" in decoded_response)
 
     def test_detail_view_content_with_tickets_if_one_types_of_tickets_was_reserved(self):
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1])
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0])
         Ticket.objects.last().reserve()
         response = event_detail_view(self.request, self.test_event.id)
         decoded_response = response.content.decode()
@@ -195,7 +280,14 @@ class TicketObjectsTest(BaseSetUp):
     def test_ticket_creation(self):
         self.assertEqual(Ticket.objects.count(), 1)
         self.assertFalse(self.test_ticket.is_sold)
-        self.assertEqual(self.test_ticket.category, "Normal")
+        self.assertEqual(self.test_ticket.category, "N")
+        self.assertEqual(self.test_ticket.get_category_display(), "Normal")
+
+    def test_compact_ticket_categories(self):
+        Ticket.objects.filter(id=self.test_ticket.id).update(category="VIP")
+        call_command("compact_ticket_categories", stdout=StringIO())
+        self.test_ticket.refresh_from_db()
+        self.assertEqual(self.test_ticket.category, "V")
 
     def test_is_remove_ticket_not_remove_event(self):
         self.assertEqual(Ticket.objects.count(), 1)
@@ -250,9 +342,9 @@ class TestOrderObject(BaseSetUp):
 class TestBasketObject(BaseSetUp):
     def setUp(self):
         super().setUp()
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1], price=10)
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1], price=20)
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1], price=30)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0], price=20)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0], price=30)
         session = self.client.get('/')
         request = HttpRequest()
         request.session = session
@@ -276,19 +368,19 @@ class TestBasketObject(BaseSetUp):
         self.assertEqual(Ticket.objects.filter(reservation_time__minute=timezone.now().minute).count(), 3)
 
     def test_add_ticket_to_basket(self):
-        self.assertEqual(self.test_basket.basket, {})
+        self.assertEqual(self.test_basket.basket, [])
         self.test_basket.add(Ticket.objects.last())
-        self.assertEqual(self.test_basket.basket, {'3': {'price': '30.00', 'category': 'VIP'}})
+        self.assertEqual(self.test_basket.basket, [3])
 
     def test_remove_non_existing_ticket_from_basket(self):
-        self.assertEqual(self.test_basket.basket, {})
-        self.assertRaises(NonExistingTicketToRemove, self.test_basket.remove, event_id=self.test_event.id, category='Normal')
+        self.assertEqual(self.test_basket.basket, [])
+        self.assertRaises(NonExistingTicketToRemove, self.test_basket.remove, event_id=self.test_event.id, category='N')
 
     def test_remove_existing_ticket_from_basket(self):
         self.test_basket.add(Ticket.objects.last())
-        self.assertEqual(self.test_basket.basket, {'3': {'price': '30.00', 'category': 'VIP'}})
-        self.test_basket.remove(self.test_event.id, "VIP")
-        self.assertEqual(self.test_basket.basket, {})
+        self.assertEqual(self.test_basket.basket, [3])
+        self.test_basket.remove(self.test_event.id, "V")
+        self.assertEqual(self.test_basket.basket, [])
 
     def test_get_total_price(self):
         self.assertEqual(self.test_basket.get_total_price(), 0)
@@ -296,18 +388,47 @@ class TestBasketObject(BaseSetUp):
             self.test_basket.add(t)
         self.assertEqual(self.test_basket.get_total_price(), 60)
 
+    def test_get_total_price_is_decimal_computed_once(self):
+        for t in Ticket.objects.all():
+            self.test_basket.add(t)
+        total_price = self.test_basket.get_total_price()
+        self.assertIsInstance(total_price, Decimal)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.test_basket.get_total_price(), Decimal('60.00'))
+
+    def test_buy_with_wrong_amount(self):
+        for t in Ticket.objects.all():
+            self.test_basket.add(t)
+        Ticket.objects.filter(category=Ticket.CATEGORY[0][0]).update(price=15)
+        self.assertRaises(PaymentAmountMismatch, self.test_basket.buy, "test_name", "test_surname", Decimal(60))
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Ticket.objects.filter(is_sold=True).count(), 0)
+        self.test_basket.buy("test_name", "test_surname", Decimal(65))
+        self.assertEqual(Ticket.objects.filter(is_sold=True).count(), 3)
+
+    def test_buy_view_checks_amount(self):
+        Ticket.objects.filter(category=Ticket.CATEGORY[0][0]).delete()
+        self.client.get(f"/{self.test_event.id}/reserve/Premium")
+        payment = {'name': "test_name", 'surname': "test_surname", 'currency': "EUR", 'amount': "19.99"}
+        response = self.client.post("/basket/buy", payment)
+        self.assertEqual(response.context['payment_error'], payment_error_message("EUR", Decimal('19.99')))
+        self.assertEqual(Order.objects.count(), 0)
+        response = self.client.post("/basket/buy", {**payment, 'amount': "20.00"})
+        self.assertIsNone(response.context['payment_error'])
+        self.assertEqual(Ticket.objects.filter(is_sold=True).count(), 1)
+
     def test_remove_expired_tickets_with_ticket_to_remove(self):
         for t in Ticket.objects.all():
             self.test_basket.add(t)
 
-        self.assertNotEqual(self.test_basket.basket, {})
+        self.assertNotEqual(self.test_basket.basket, [])
 
         for t in Ticket.objects.all():
             t.reservation_time = timezone.now()
             t.save()
 
         self.test_basket._remove_expired_tickets()
-        self.assertEqual(self.test_basket.basket, {})
+        self.assertEqual(self.test_basket.basket, [])
 
     def test_get_tickets_ob_by_tickets_id_in_basket(self):
         self.assertEqual(len(self.test_basket._get_tickets_ob_by_tickets_id_in_basket()), 0)
@@ -366,22 +487,106 @@ class OrderPlotterTest(PlotterTestSetup):
         super().setUp()
         self.order_plotter = OrderPlotter()
         self.test_event = Event.objects.create(name="Test Event", time_and_date=timezone.now())
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][1], price=10)
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][1], price=20,  order=self.test_order_one, is_sold=True)
-        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][1], price=30,  order=self.test_order_two)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0], price=20,  order=self.test_order_one, is_sold=True)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0], price=30,  order=self.test_order_two)
+        rebuild_daily_sales()
+
+    def test_get_days_range(self):
+        self.assertEqual(len(self.order_plotter.get_days_range()), 4)
+        self.assertEqual(self.order_plotter.get_days_range()[0], self.test_order_one.time_and_date.date())
+
+    def test_get_number_of_objects_per_day(self):
+        self.assertEqual(self.order_plotter.get_number_of_objects_per_day(), [1, 0, 0, 1])
 
     def test_get_number_of_sold_tickets_by_category(self):
-        self.assertEqual(self.order_plotter.get_number_of_sold_tickets_by_category('Normal'), [0, 0, 0, 0, 0])
-        self.assertEqual(self.order_plotter.get_number_of_sold_tickets_by_category('VIP'), [0, 0, 0, 1, 0])
+        self.assertEqual(self.order_plotter.get_number_of_sold_tickets_by_category('N'), [0, 0, 0, 0])
+        self.assertEqual(self.order_plotter.get_number_of_sold_tickets_by_category('V'), [0, 0, 0, 1])
 
     def test_get_sold_tickets_per_day(self):
-        self.assertEqual(self.order_plotter.get_sold_tickets_per_day(), [1, 0, 0, 1, 0])
+        self.assertEqual(self.order_plotter.get_sold_tickets_per_day(), [1, 0, 0, 1])
 
     def test_get_amount_of_cash_from_tickets_per_day_total(self):
-        self.assertEqual(self.order_plotter.get_amount_of_cash_from_tickets_per_day_total(), [20, 0, 0, 30, 0])
+        self.assertEqual(self.order_plotter.get_amount_of_cash_from_tickets_per_day_total(), [20, 0, 0, 30])
 
     def test_get_amount_of_cash_from_ticket_per_day_for_category(self):
-        self.assertEqual(self.order_plotter.get_amount_of_cash_from_ticket_per_day_for_category('Premium'), [20, 0, 0, 0, 0])
+        self.assertEqual(self.order_plotter.get_amount_of_cash_from_ticket_per_day_for_category('P'), [20, 0, 0, 0])
+
+
+class OrderPlotterBucketsTest(TestCase):
+
+    def setUp(self):
+        self.first_day = datetime.date(2020, 1, 1)
+        for day in range(800):
+            DailySales.objects.create(
+                date=self.first_day + datetime.timedelta(days=day), orders=1, tickets_sold=2, revenue=10
+            )
+
+    def test_auto_resolution_keeps_points_under_limit(self):
+        self.assertEqual(OrderPlotter(max_points=1000).resolution, "day")
+        self.assertEqual(OrderPlotter(max_points=200).resolution, "week")
+        plotter = OrderPlotter(max_points=30)
+        self.assertEqual(plotter.resolution, "month")
+        self.assertEqual(len(plotter.get_days_range()), 27)
+        self.assertEqual(plotter.get_number_of_objects_per_day()[:2], [31, 29])
+
+    def test_date_window_and_weekly_buckets(self):
+        plotter = OrderPlotter(
+            date_from=datetime.date(2020, 1, 6), date_to=datetime.date(2020, 1, 15), resolution="week"
+        )
+        self.assertEqual(plotter.get_days_range(), [datetime.date(2020, 1, 6), datetime.date(2020, 1, 13)])
+        self.assertEqual(plotter.get_amount_of_cash_from_tickets_per_day_total(), [70, 30])
+
+    def test_downsample_lttb(self):
+        x = list(range(1000))
+        y = [0] * 1000
+        y[500] = 100
+        sampled_x, sampled_y = downsample_lttb(x, y, 50)
+        self.assertEqual(len(sampled_x), 50)
+        self.assertEqual((sampled_x[0], sampled_x[-1]), (0, 999))
+        self.assertIn(100, sampled_y)
+        self.assertEqual(downsample_lttb(x[:10], y[:10], 50), (x[:10], y[:10]))
+
+
+class DailySalesTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0], price=30)
+        session = self.client.get('/')
+        request = HttpRequest()
+        request.session = session
+        self.test_basket = Basket(request)
+
+    def test_buy_updates_daily_sales(self):
+        for t in Ticket.objects.all():
+            self.test_basket.add(t)
+        self.test_basket.buy("test_name", "test_surname")
+        rows = {row.category: row for row in DailySales.objects.filter(date=timezone.localdate())}
+        self.assertEqual(len(rows), 3)
+        self.assertEqual((rows[''].orders, rows[''].tickets_sold, rows[''].revenue), (1, 3, 50))
+        self.assertEqual((rows['N'].orders, rows['N'].tickets_sold, rows['N'].revenue), (1, 2, 20))
+        self.assertEqual((rows['V'].orders, rows['V'].tickets_sold, rows['V'].revenue), (1, 1, 30))
+
+    def test_rebuild_gives_same_rows_as_checkout(self):
+        for t in Ticket.objects.all():
+            self.test_basket.add(t)
+        self.test_basket.buy("test_name", "test_surname")
+        rows = list(DailySales.objects.order_by('category').values('category', 'orders', 'tickets_sold', 'revenue'))
+        call_command("rebuild_daily_sales", stdout=StringIO())
+        self.assertEqual(
+            list(DailySales.objects.order_by('category').values('category', 'orders', 'tickets_sold', 'revenue')), rows
+        )
+
+    def test_basket_with_tickets_sold_meanwhile_records_nothing(self):
+        for t in Ticket.objects.all():
+            self.test_basket.add(t)
+        Ticket.objects.update(is_sold=True)
+        self.test_basket.buy("test_name", "test_surname")
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(DailySales.objects.exists())
 
 
 class TestUtils(PlotterTestSetup):
@@ -399,3 +604,823 @@ class TestUtils(PlotterTestSetup):
 
     def test_turn_none_into_zero(self):
         self.assertEqual(turn_none_into_zero(None), 0)
+
+
+class RateLimitTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_sliding_window_consume(self):
+        window = SlidingWindow("test-window", RateLimit(capacity=2, period=60))
+        now = 60 * 1000
+        self.assertEqual(window.consume(now=now), 0)
+        self.assertEqual(window.consume(now=now + 1), 0)
+        self.assertEqual(window.consume(now=now + 30), 30)
+        self.assertEqual(window.check(now=now + 30), 30)
+        self.assertEqual(window.consume(now=now + 60), 30)
+        self.assertEqual(window.consume(now=now + 90), 0)
+        self.assertEqual(cache.get(f"test-window:{1000}"), 2)
+        self.assertEqual(cache.get(f"test-window:{1001}"), 1)
+
+    @override_settings(RATE_LIMITS={'reserve_ticket': (1, 60)})
+    def test_reserve_ticket_throttled(self):
+        self.client.session.save()
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal")
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal")
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+        self.assertEqual(Ticket.objects.filter(reservation_time__gt=timezone.now()).count(), 1)
+
+    @override_settings(RATE_LIMITS={'reserve_ticket': (1, 60)})
+    def test_rejected_request_does_not_use_ip_limit(self):
+        session_key = self.client.session.session_key
+        SlidingWindow(f"throttle:reserve_ticket:session:{session_key}", RateLimit(1, 60)).consume()
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(SlidingWindow("throttle:reserve_ticket:ip:127.0.0.1", RateLimit(1, 60)).check(), 0)
+
+    @override_settings(RATE_LIMITS={'reserve_ticket': (5, 60)}, IP_RATE_LIMITS={'reserve_ticket': (1, 60)})
+    def test_ip_limit_is_separate_from_session_limit(self):
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal")
+        self.assertEqual(response.status_code, 302)
+        self.client.cookies.clear()
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal")
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(IP_RATE_LIMITS={'reserve_ticket': (1, 60)}, RATE_LIMIT_TRUST_FORWARDED_FOR=True)
+    def test_ip_limit_uses_forwarded_address_behind_proxy(self):
+        for address in ("203.0.113.1", "203.0.113.2"):
+            self.client.cookies.clear()
+            response = self.client.get(
+                f"/{self.test_event.id}/reserve/Normal", HTTP_X_FORWARDED_FOR=f"{address}, 10.0.0.1"
+            )
+            self.assertEqual(response.status_code, 302)
+        self.client.cookies.clear()
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal", HTTP_X_FORWARDED_FOR="203.0.113.1")
+        self.assertEqual(response.status_code, 429)
+
+
+class BasketStorageTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.request = HttpRequest()
+        self.request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+
+    def test_session_storage_writes_only_changed_basket(self):
+        storage = SessionBasketStorage(self.request)
+        self.assertEqual(storage.load(), [])
+        self.assertTrue(storage.save([3, 1]))
+        self.assertEqual(self.request.session[settings.BASKET_SESSION_ID], [1, 3])
+        self.request.session.modified = False
+        self.assertFalse(storage.save([1, 3]))
+        self.assertFalse(self.request.session.modified)
+
+    def test_session_storage_with_old_basket_format(self):
+        self.request.session[settings.BASKET_SESSION_ID] = {'3': {'price': '30.00', 'category': 'VIP'}}
+        self.assertEqual(SessionBasketStorage(self.request).load(), [3])
+
+    def test_cache_storage(self):
+        CacheBasketStorage(self.request).save([1, 2])
+        self.assertIsNotNone(self.request.session.session_key)
+        self.assertNotIn(settings.BASKET_SESSION_ID, self.request.session)
+        self.assertEqual(CacheBasketStorage(self.request).load(), [1, 2])
+
+    @override_settings(BASKET_STORAGE='main.basket_storage.CacheBasketStorage')
+    def test_basket_pages_with_cache_storage(self):
+        event = Event.objects.create(name="Test Event", time_and_date=timezone.now())
+        Ticket.objects.create(event=event, category=Ticket.CATEGORY[0][0], price=10)
+        self.assertEqual(self.client.get(f"/{event.id}/reserve/Normal").status_code, 302)
+        for url in ("/basket", "/basket/buy"):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "Total price for all tickets: 10")
+
+    def test_basket_badge_is_cached_per_session(self):
+        self.client.session.save()
+        response = self.client.get("/")
+        key = [self.client.session.session_key, get_basket_storage(response.wsgi_request).version]
+        self.assertIsNotNone(cache.get(make_template_fragment_key('basket_badge', key)))
+        self.assertIsNone(cache.get(make_template_fragment_key('basket_badge', [None, key[1]])))
+
+    def test_signed_cookie_storage(self):
+        storage = SignedCookieBasketStorage(self.request)
+        storage.save([1, 2])
+        response = HttpResponse()
+        storage.update(response)
+        next_request = HttpRequest()
+        next_request.COOKIES[storage.cookie_name] = response.cookies[storage.cookie_name].value
+        self.assertEqual(SignedCookieBasketStorage(next_request).load(), [1, 2])
+        next_request.COOKIES[storage.cookie_name] = "1,2,3"
+        self.assertEqual(SignedCookieBasketStorage(next_request).load(), [])
+
+
+class ExportSalesTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.test_order = Order.objects.create(name="test_name", surname="test_surname")
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(
+            event=self.test_event, category=Ticket.CATEGORY[2][0], price=30, order=self.test_order, is_sold=True
+        )
+
+    def test_export_requires_staff(self):
+        response = self.client.get("/export/sales.csv")
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_csv(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        response = self.client.get("/export/sales.csv")
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("order_id,order_time,name,surname,ticket_id"))
+        self.assertTrue(lines[1].endswith("Test Event,{},VIP,30.00".format(self.test_event.time_and_date)))
+
+    def test_export_unknown_format(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        response = self.client.get("/export/sales.xml")
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_sales_command_jsonl(self):
+        out = StringIO()
+        call_command("export_sales", format="jsonl", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('"category": "VIP", "price": "30.00"', lines[0])
+
+    def test_export_includes_archived_sales(self):
+        Event.objects.update(time_and_date=self.test_datetime - timezone.timedelta(days=60))
+        call_command("archive_events", days=30, stdout=StringIO())
+        self.assertFalse(Order.objects.exists())
+        out = StringIO()
+        call_command("export_sales", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f"{self.test_order.id},"))
+        self.assertTrue(lines[1].endswith("VIP,30.00"))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class PrimaryReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_outside_replica_block_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Event), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Event), 'replica')
+        self.assertEqual(self.router.db_for_write(Ticket), 'default')
+
+    def test_replica_is_not_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'main'))
+        self.assertFalse(self.router.allow_migrate('replica', 'main'))
+
+    def test_client_which_wrote_is_pinned_to_primary(self):
+        def view(request):
+            with replica_reads():
+                self.assertEqual(self.router.db_for_read(Ticket), 'replica')
+                self.router.db_for_write(Ticket)
+                self.assertEqual(self.router.db_for_read(Ticket), 'default')
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(HttpRequest())
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        def next_view(request):
+            with replica_reads():
+                self.assertEqual(self.router.db_for_read(Ticket), 'default')
+            return HttpResponse()
+
+        request = HttpRequest()
+        request.COOKIES[ReplicaPinningMiddleware.cookie_name] = '1'
+        ReplicaPinningMiddleware(next_view)(request)
+
+
+SHARD_ROUTERS = ['main.routers.TicketShardRouter', 'main.routers.PrimaryReplicaRouter']
+TEST_SHARDS = ['tickets_0', 'tickets_1']
+TEST_SHARDS_CONFIGURED = set(TEST_SHARDS) <= set(settings.DATABASES)
+
+
+@override_settings(TICKET_SHARDS=['default'], DATABASE_ROUTERS=SHARD_ROUTERS)
+class TicketShardRouterTest(BaseSetUp):
+
+    def test_ticket_ids_are_allocated_from_sequence(self):
+        first = Ticket.objects.create(event=self.test_event)
+        second = Ticket.objects.create(event=self.test_event)
+        self.assertEqual(second.id, first.id + 1)
+        self.assertEqual(TicketIdSequence.objects.get().next_slot, second.id + 1)
+
+    @override_settings(TICKET_SHARDS=TEST_SHARDS)
+    def test_shard_is_chosen_by_event_and_encoded_in_ticket_id(self):
+        router = TicketShardRouter()
+        self.assertEqual(shard_for_event(4), 'tickets_0')
+        self.assertEqual(shard_for_event(5), 'tickets_1')
+        self.assertEqual(group_by_shard([7, 2, 3, 4]), [('tickets_0', [2, 4]), ('tickets_1', [7, 3])])
+        self.assertEqual(router.db_for_read(Ticket, instance=Event(id=5)), 'tickets_1')
+        self.assertIsNone(router.db_for_read(Event, instance=Event(id=5)))
+        self.assertIsNone(router.db_for_read(Ticket))
+        self.assertFalse(router.allow_migrate('tickets_0', 'main', 'event'))
+        self.assertTrue(router.allow_migrate('tickets_0', 'main', 'ticket'))
+
+
+@skipUnless(TEST_SHARDS_CONFIGURED, "'tickets_0' and 'tickets_1' databases are not configured")
+@override_settings(TICKET_SHARDS=TEST_SHARDS, DATABASE_ROUTERS=SHARD_ROUTERS)
+class TicketShardingTest(TestCase):
+    databases = {'default', *TEST_SHARDS} if TEST_SHARDS_CONFIGURED else {'default'}
+
+    def setUp(self):
+        self.events = [
+            Event.objects.create(name=f"Event {i}", time_and_date=timezone.now() + timezone.timedelta(days=1))
+            for i in range(2)
+        ]
+        self.tickets = [Ticket.objects.create(event=event, price=10) for event in self.events for _ in range(2)]
+        session = self.client.get('/')
+        request = HttpRequest()
+        request.session = session
+        self.test_basket = Basket(request)
+
+    def test_tickets_are_stored_on_shard_of_event(self):
+        for event in self.events:
+            database = shard_for_event(event.id)
+            self.assertEqual(Ticket.objects.using(database).filter(event=event).count(), 2)
+            self.assertEqual(event.get_sum_of_available_tickets(), 2)
+        for ticket in self.tickets:
+            self.assertEqual(shard_for_ticket(ticket.id), shard_for_event(ticket.event_id))
+
+    def test_buy_basket_with_tickets_from_many_shards(self):
+        self.test_basket.add(self.tickets[0])
+        self.test_basket.add(self.tickets[2])
+        self.assertEqual(self.test_basket.get_total_price(), 20)
+        self.test_basket.buy("test_name", "test_surname")
+        order = Order.objects.get()
+        for database in TEST_SHARDS:
+            self.assertEqual(Ticket.objects.using(database).filter(is_sold=True, order_id=order.id).count(), 1)
+        self.assertEqual(PlatformTotals.get().sold_tickets, 2)
+
+    def test_failed_shard_gives_back_tickets_sold_on_previous_shards(self):
+        self.test_basket.add(self.tickets[0])
+        self.test_basket.add(self.tickets[2])
+        failing_shard = max(shard_for_event(event.id) for event in self.events)
+        original_buy = Ticket.buy
+
+        def buy(ticket, order):
+            if ticket._state.db == failing_shard:
+                raise RuntimeError
+            original_buy(ticket, order)
+
+        with mock.patch.object(Ticket, 'buy', buy), self.assertRaises(RuntimeError):
+            self.test_basket.buy("test_name", "test_surname")
+        self.assertFalse(Order.objects.exists())
+        for database in TEST_SHARDS:
+            self.assertFalse(Ticket.objects.using(database).filter(is_sold=True).exists())
+
+    def test_wrong_amount_keeps_holds_on_all_shards(self):
+        self.test_basket.add(self.tickets[0])
+        self.test_basket.add(self.tickets[2])
+        self.assertRaises(PaymentAmountMismatch, self.test_basket.buy, "test_name", "test_surname", Decimal(15))
+        self.assertFalse(Order.objects.exists())
+        for database in TEST_SHARDS:
+            self.assertFalse(Ticket.objects.using(database).filter(is_sold=True).exists())
+            self.assertEqual(Ticket.objects.using(database).filter(reservation_time__gt=timezone.now()).count(), 1)
+        self.assertEqual(len(self.test_basket), 2)
+
+    def test_failed_totals_update_sells_nothing(self):
+        self.test_basket.add(self.tickets[0])
+        self.test_basket.add(self.tickets[2])
+        with mock.patch.object(PlatformTotals, 'add', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.test_basket.buy("test_name", "test_surname", Decimal(20))
+        for database in TEST_SHARDS:
+            self.assertFalse(Ticket.objects.using(database).filter(is_sold=True).exists())
+            self.assertEqual(Ticket.objects.using(database).filter(reservation_time__gt=timezone.now()).count(), 1)
+
+    def test_admin_counts_tickets_on_shards(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.tickets[0].reserve()
+        self.test_basket.add(self.tickets[2])
+        self.test_basket.buy("test_name", "test_surname")
+        response = self.client.get("/admin/main/event/")
+        self.assertEqual(
+            {event.id: (event.available_tickets, event.sold_tickets) for event in response.context['cl'].result_list},
+            {self.events[0].id: (1, 0), self.events[1].id: (1, 1)},
+        )
+        self.assertNotIn('reprice', dict(response.context['action_form'].fields['action'].choices))
+        response = self.client.get("/admin/main/order/")
+        self.assertEqual(response.context['cl'].result_list[0].tickets, 1)
+        self.assertEqual(self.client.get("/admin/main/ticket/").status_code, 403)
+
+    def test_archive_and_export_tickets_on_shards(self):
+        self.test_basket.add(self.tickets[0])
+        self.test_basket.add(self.tickets[2])
+        self.test_basket.buy("test_name", "test_surname")
+        out = StringIO()
+        call_command("export_sales", stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+        Event.objects.filter(pk=self.events[0].pk).update(time_and_date=timezone.now() - timezone.timedelta(days=60))
+        call_command("archive_events", days=30, stdout=StringIO())
+        self.assertFalse(Ticket.objects.using(shard_for_event(self.events[0].id)).exists())
+        self.assertEqual(Ticket.objects.using(shard_for_event(self.events[1].id)).count(), 2)
+        self.assertEqual(ArchivedTicket.objects.count(), 2)
+        self.assertTrue(Order.objects.exists())
+        self.assertFalse(ArchivedOrder.objects.exists())
+        archived_out = StringIO()
+        call_command("export_sales", stdout=archived_out)
+        self.assertEqual(
+            [line.split(",")[:5] for line in archived_out.getvalue().splitlines()],
+            [line.split(",")[:5] for line in out.getvalue().splitlines()],
+        )
+
+    def test_commands_joining_tickets_refuse_sharded_inventory(self):
+        self.assertRaises(CommandError, call_command, "rebuild_daily_sales", stdout=StringIO())
+        self.assertRaises(CommandError, call_command, "reprice_tickets", stdout=StringIO())
+
+
+class ArchiveEventsTest(TestCase):
+
+    def setUp(self):
+        self.past_event = Event.objects.create(
+            name="Past Event", time_and_date=timezone.now() - timezone.timedelta(days=60)
+        )
+        self.future_event = Event.objects.create(
+            name="Future Event", time_and_date=timezone.now() + timezone.timedelta(days=1)
+        )
+        self.past_order = Order.objects.create(name="test1", surname="test1")
+        self.shared_order = Order.objects.create(name="test2", surname="test2")
+        Ticket.objects.create(event=self.past_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(
+            event=self.past_event, category=Ticket.CATEGORY[1][0], price=20, order=self.past_order, is_sold=True
+        )
+        Ticket.objects.create(
+            event=self.past_event, category=Ticket.CATEGORY[2][0], price=30, order=self.shared_order, is_sold=True
+        )
+        Ticket.objects.create(
+            event=self.future_event, category=Ticket.CATEGORY[2][0], price=40, order=self.shared_order, is_sold=True
+        )
+
+    def test_archive_events(self):
+        call_command("archive_events", days=30, batch_size=2, stdout=StringIO())
+        self.assertEqual(Ticket.objects.count(), 1)
+        self.assertEqual(ArchivedTicket.objects.count(), 3)
+        self.assertEqual(list(Order.objects.all()), [self.shared_order])
+        self.assertEqual(ArchivedOrder.objects.get().name, "test1")
+        self.past_event.refresh_from_db()
+        self.assertTrue(self.past_event.is_archived)
+        summary = EventArchiveSummary.objects.get(event=self.past_event)
+        self.assertEqual((summary.total_tickets, summary.sold_tickets), (3, 2))
+        self.assertEqual((summary.profit, summary.possible_profit), (50, 60))
+
+    def test_stats_include_archived_tickets(self):
+        call_command("archive_events", days=30, stdout=StringIO())
+        response = self.client.get("/stats")
+        self.assertEqual(response.context['total_num_of_tickets'], 4)
+        self.assertEqual(response.context['total_sold_tickets'], 3)
+        self.assertEqual(response.context['total_profit'], 90)
+        self.assertEqual(response.context['total_possible_profit'], 100)
+        past_summary = get_event_summary(Event.objects.select_related('archive_summary').get(id=self.past_event.id))
+        self.assertEqual(past_summary.total_tickets, 3)
+        self.assertEqual(past_summary.profit, 50)
+
+    def test_rebuild_daily_sales_includes_archive(self):
+        Ticket.objects.create(
+            event=self.past_event, category=Ticket.CATEGORY[2][0], price=5, order=self.shared_order, is_sold=True
+        )
+        Ticket.objects.create(
+            event=self.future_event, category=Ticket.CATEGORY[2][0], price=7, order=self.shared_order, is_sold=True
+        )
+        call_command("rebuild_daily_sales", stdout=StringIO())
+        fields = ('date', 'category', 'orders', 'tickets_sold', 'revenue')
+        rows = list(DailySales.objects.order_by('category').values_list(*fields))
+        self.assertEqual([row[2:] for row in rows], [(2, 5, 102), (1, 1, 20), (1, 4, 82)])
+        call_command("archive_events", days=30, stdout=StringIO())
+        call_command("rebuild_daily_sales", stdout=StringIO())
+        self.assertEqual(list(DailySales.objects.order_by('category').values_list(*fields)), rows)
+
+
+class PlatformTotalsTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=10)
+        Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0], price=20)
+        self.sold_ticket = Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[2][0], price=30)
+        session = self.client.get('/')
+        request = HttpRequest()
+        request.session = session
+        self.test_basket = Basket(request)
+
+    def assertTotalsEqual(self, expected):
+        totals = PlatformTotals.get()
+        self.assertEqual(
+            (totals.events, totals.tickets, totals.sold_tickets, totals.profit, totals.possible_profit), expected
+        )
+
+    def test_totals_follow_creation_sale_and_removal(self):
+        self.assertTotalsEqual((1, 3, 0, 0, 60))
+        self.test_basket.add(self.sold_ticket)
+        self.test_basket.buy("test_name", "test_surname")
+        self.assertTotalsEqual((1, 3, 1, 30, 60))
+        Ticket.objects.filter(is_sold=False).first().delete()
+        self.assertTotalsEqual((1, 2, 1, 30, 50))
+        rebuilt = PlatformTotals.rebuild()
+        self.assertEqual((rebuilt.tickets, rebuilt.sold_tickets, rebuilt.profit), (2, 1, 30))
+
+    @override_settings(STATS_APPROXIMATE_COUNTS=True)
+    def test_stats_footer(self):
+        response = self.client.get("/stats")
+        self.assertEqual(response.context['total_num_of_events'], 1)
+        self.assertEqual(response.context['total_num_of_tickets'], 3)
+        self.assertEqual(response.context['total_possible_profit'], 60)
+
+
+class StartupBenchmarkTest(TestCase):
+
+    def test_charting_stack_is_not_imported_on_startup(self):
+        out = StringIO()
+        call_command("startup_benchmark", repeat=1, max_wsgi_ms=60000, max_urlconf_ms=60000, stdout=out)
+        self.assertIn("URLConf import", out.getvalue())
+
+
+class SeatMapTest(TestCase):
+
+    def test_find_best_block_prefers_front_row_and_center(self):
+        seats = [(row * 10 + number, "A", row, number, True) for row in (1, 2) for number in range(1, 8)]
+        seat_map = SeatMap(seats)
+        self.assertEqual(seat_map.find_best_block(3), [13, 14, 15])
+        seat_map.take([14])
+        self.assertEqual(seat_map.find_best_block(3), [11, 12, 13])
+        seat_map.take([12])
+        self.assertEqual(seat_map.find_best_block(3), [15, 16, 17])
+        seat_map.take([16])
+        self.assertEqual(seat_map.find_best_block(3), [23, 24, 25])
+        self.assertIsNone(seat_map.find_best_block(8))
+        seat_map.release([12, 14, 16])
+        self.assertEqual(seat_map.find_best_block(7), [11, 12, 13, 14, 15, 16, 17])
+
+    def test_find_best_block_is_fast(self):
+        seats = [
+            (row * 1000 + number, "A", row, number, number % 7 != 0) for row in range(100) for number in range(100)
+        ]
+        seat_map = SeatMap(seats)
+        start = time.perf_counter()
+        for _ in range(100):
+            seat_map.find_best_block(6)
+        self.assertLess((time.perf_counter() - start) / 100, 0.001)
+
+
+class AllocateSeatsTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        _seat_maps.clear()
+        for row in (1, 2):
+            for number in range(1, 6):
+                Ticket.objects.create(
+                    event=self.test_event, category=Ticket.CATEGORY[0][0],
+                    seat=Seat.objects.create(section="A", row=row, number=number)
+                )
+
+    def get_seats(self, ticket_ids):
+        return [(t.seat.row, t.seat.number) for t in Ticket.objects.filter(id__in=ticket_ids).order_by('seat__number')]
+
+    def test_allocate_seats_holds_tickets(self):
+        ticket_ids = allocate_seats(self.test_event.id, "N", 3)
+        self.assertEqual(self.get_seats(ticket_ids), [(1, 2), (1, 3), (1, 4)])
+        self.assertEqual(Ticket.objects.filter(reservation_time__gt=timezone.now()).count(), 3)
+        ticket_ids = allocate_seats(self.test_event.id, "N", 3)
+        self.assertEqual(self.get_seats(ticket_ids), [(2, 2), (2, 3), (2, 4)])
+        self.assertEqual(allocate_seats(self.test_event.id, "N", 3), [])
+
+    def test_allocate_seats_retry_when_seat_was_taken_by_other_worker(self):
+        allocate_seats(self.test_event.id, "N", 1)
+        Ticket.objects.get(seat__row=1, seat__number=2).reserve()
+        ticket_ids = allocate_seats(self.test_event.id, "N", 2)
+        self.assertEqual(self.get_seats(ticket_ids), [(1, 4), (1, 5)])
+
+    def test_reserve_seats_view(self):
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal/seats?quantity=4")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(self.client.session[settings.BASKET_SESSION_ID]), 4)
+        response = self.client.get(f"/{self.test_event.id}/reserve/Normal/seats?quantity=6")
+        self.assertTrue("There are no 6 free seats" in response.content.decode())
+
+    def test_seat_is_shared_by_events_but_not_by_tickets_of_one_event(self):
+        seat = Seat.objects.get(row=1, number=1)
+        other_event = Event.objects.create(name="Other Event", time_and_date=self.test_datetime)
+        Ticket.objects.create(event=other_event, seat=seat)
+        self.assertEqual(Ticket.objects.filter(seat=seat).count(), 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Ticket.objects.create(event=other_event, seat=seat)
+
+
+class RepricingTest(TestCase):
+
+    def setUp(self):
+        self.test_event = Event.objects.create(
+            name="Future Event", time_and_date=timezone.now() + timezone.timedelta(days=30)
+        )
+        self.free_tickets = [
+            Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=100) for _ in range(2)
+        ]
+        self.sold_ticket = Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=100)
+        self.held_ticket = Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0], price=100)
+        self.sold_ticket.buy(Order.objects.create(name="test", surname="test"))
+        self.held_ticket.reserve()
+
+    def test_reprice_by_sell_through(self):
+        engine = RepricingEngine(rules={code: DEFAULT_RULE for code, _ in Ticket.CATEGORY})
+        self.assertEqual(engine.load(), 2)
+        self.assertEqual(engine.apply(engine.compute()), 2)
+        for ticket in self.free_tickets:
+            ticket.refresh_from_db()
+            self.assertEqual((ticket.price, ticket.base_price), (Decimal("112.50"), 100))
+        self.sold_ticket.refresh_from_db()
+        self.held_ticket.refresh_from_db()
+        self.assertEqual((self.sold_ticket.price, self.sold_ticket.base_price), (100, None))
+        self.assertEqual((self.held_ticket.price, self.held_ticket.base_price), (100, None))
+        self.assertEqual(PlatformTotals.get().possible_profit, Decimal("425.00"))
+
+    def test_repricing_starts_from_base_price(self):
+        call_command("reprice_tickets", stdout=StringIO())
+        out = StringIO()
+        call_command("reprice_tickets", stdout=out)
+        self.assertIn("0 prices changed", out.getvalue())
+        self.assertEqual(Ticket.objects.filter(price=Decimal("112.50"), base_price=100).count(), 2)
+
+    def test_held_ticket_is_not_repriced_when_reserved_meanwhile(self):
+        engine = RepricingEngine()
+        engine.load()
+        self.free_tickets[0].reserve()
+        self.assertEqual(engine.apply(engine.compute()), 1)
+        self.free_tickets[0].refresh_from_db()
+        self.assertEqual(self.free_tickets[0].price, 100)
+        self.assertEqual(PlatformTotals.get().possible_profit, Decimal("412.50"))
+
+    def test_prices_of_batch_are_written_by_single_update(self):
+        vip_tickets = [
+            Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[1][0], price=200) for _ in range(2)
+        ]
+        vip_tickets[1].buy(Order.objects.create(name="test", surname="test"))
+        engine = RepricingEngine(rules={code: DEFAULT_RULE for code, _ in Ticket.CATEGORY})
+        self.assertEqual(engine.load(), 3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(engine.apply(engine.compute(), batch_size=3), 3)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "main_ticket"')]), 1)
+        self.assertEqual(
+            sorted(Ticket.objects.filter(base_price__isnull=False).values_list('price', flat=True)),
+            [Decimal("112.50"), Decimal("112.50"), Decimal("250.00")],
+        )
+
+
+class AvailabilitySnapshotTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.test_event.time_and_date = self.test_datetime + timezone.timedelta(days=1)
+        self.test_event.save()
+        for category in ("N", "N", "V"):
+            Ticket.objects.create(event=self.test_event, category=category)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "availability")
+        patcher = mock.patch('main.availability._snapshot', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_available_tickets_are_read_from_snapshot(self):
+        with override_settings(AVAILABILITY_SNAPSHOT_PATH=self.path, AVAILABILITY_SNAPSHOT_INTERVAL=0):
+            call_command("refresh_availability", once=True, stdout=StringIO())
+            Ticket.objects.filter(category="N").first().reserve()
+            with self.assertNumQueries(0):
+                self.assertEqual(self.test_event.get_sum_of_available_tickets(), 3)
+                self.assertEqual(
+                    list(self.test_event.get_available_tickets_num_by_categories()),
+                    [("Normal", 2), ("Premium", 0), ("VIP", 1)]
+                )
+            call_command("refresh_availability", once=True, stdout=StringIO())
+            self.assertEqual(self.test_event.get_sum_of_available_tickets(), 2)
+
+    def test_stale_snapshot_and_missing_event_fall_back_to_database(self):
+        with override_settings(
+            AVAILABILITY_SNAPSHOT_PATH=self.path, AVAILABILITY_SNAPSHOT_INTERVAL=0, AVAILABILITY_SNAPSHOT_MAX_AGE=2
+        ):
+            write_snapshot(self.path, np.array([self.test_event.id]), np.array([[7, 0, 0]]), time.time() - 10)
+            self.assertEqual(self.test_event.get_sum_of_available_tickets(), 3)
+            write_snapshot(self.path, np.array([self.test_event.id]), np.array([[7, 0, 0]]))
+            self.assertEqual(self.test_event.get_sum_of_available_tickets(), 7)
+            other_event = Event.objects.create(name="Other", time_and_date=self.test_event.time_and_date)
+            self.assertEqual(other_event.get_sum_of_available_tickets(), 0)
+
+    def test_event_card_is_rendered_with_live_count(self):
+        cache.clear()
+        with override_settings(AVAILABILITY_SNAPSHOT_PATH=self.path, AVAILABILITY_SNAPSHOT_INTERVAL=0):
+            call_command("refresh_availability", once=True, stdout=StringIO())
+            self.client.get(f"/{self.test_event.id}/reserve/Normal")
+            self.assertEqual(self.test_event.get_sum_of_available_tickets(), 3)
+            self.assertContains(self.client.get("/"), "Available tickets: 2")
+
+
+class ScalableAdminTest(BaseSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.tickets = [Ticket.objects.create(event=self.test_event, price=10) for _ in range(3)]
+        self.tickets[0].reserve()
+
+    def test_changelists_with_annotated_counts(self):
+        response = self.client.get("/admin/main/event/")
+        self.assertEqual(response.status_code, 200)
+        event = response.context['cl'].result_list[0]
+        self.assertEqual((event.available_tickets, event.sold_tickets), (2, 0))
+        self.assertEqual(self.client.get("/admin/main/ticket/").status_code, 200)
+        self.assertEqual(self.client.get("/admin/main/order/").status_code, 200)
+
+    def test_changelists_do_not_scan_dates_of_whole_table(self):
+        for url in ("/admin/main/event/", "/admin/main/order/"):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertFalse([query for query in queries if "DISTINCT" in query['sql']])
+
+    def test_paginator_uses_estimate_for_unfiltered_changelist(self):
+        with mock.patch('main.admin.estimate_row_count', return_value=5000000):
+            response = self.client.get("/admin/main/ticket/")
+            self.assertEqual(response.context['cl'].result_count, 5000000)
+            response = self.client.get("/admin/main/ticket/", {"is_sold__exact": "0"})
+            self.assertEqual(response.context['cl'].result_count, 3)
+
+    def run_action(self, action, tickets):
+        return self.client.post("/admin/main/ticket/", {
+            "action": action, "_selected_action": [ticket.id for ticket in tickets],
+        })
+
+    def test_release_holds_and_mark_sold(self):
+        self.run_action("release_holds", self.tickets)
+        self.assertEqual(Ticket.objects.filter(reservation_time__gt=timezone.now()).count(), 0)
+        self.tickets[1].reserve()
+        self.run_action("mark_sold", self.tickets)
+        self.assertEqual(Ticket.objects.filter(is_sold=True).count(), 2)
+        self.assertFalse(Ticket.objects.get(id=self.tickets[1].id).is_sold)
+        order = Order.objects.get()
+        self.assertEqual(order.ticket_set.count(), 2)
+        self.assertEqual(PlatformTotals.get().profit, 20)
+        self.assertEqual(DailySales.objects.get(category=DailySales.ALL_CATEGORIES).revenue, 20)
+
+
+@override_settings(BOX_OFFICE_API_KEYS=["secret"])
+class BoxOfficeApiTest(TestCase):
+
+    def setUp(self):
+        self.events = [
+            Event.objects.create(name=f"Event {i}", time_and_date=timezone.now() + timezone.timedelta(days=1))
+            for i in range(2)
+        ]
+        for event in self.events:
+            for category in ("N", "N", "N", "V"):
+                Ticket.objects.create(event=event, category=category, price=10 if category == "N" else 50)
+        Ticket.objects.filter(event=self.events[0], category="N").first().reserve()
+
+    def post(self, body, key="key-1", api_key="secret"):
+        return self.client.post(
+            "/api/box-office/purchase", json.dumps(body), content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {api_key}", HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def get_body(self, first_quantity=2):
+        return {"name": "Box", "surname": "Office", "lines": [
+            {"event_id": self.events[0].id, "category": "Normal", "quantity": first_quantity},
+            {"event_id": self.events[1].id, "category": "V", "quantity": 1},
+        ]}
+
+    def test_purchase_many_lines_in_one_call(self):
+        response = self.post(self.get_body())
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(len(data['tickets']), 3)
+        self.assertEqual(data['total_price'], "70.00")
+        self.assertEqual(
+            sorted(Ticket.objects.filter(order_id=data['order_id']).values_list('id', flat=True)), data['tickets']
+        )
+        self.assertEqual(Ticket.objects.filter(reservation_time__gt=timezone.now(), is_sold=False).count(), 1)
+        self.assertEqual(PlatformTotals.get().profit, 70)
+
+    def test_repeated_key_returns_the_same_tickets(self):
+        first = self.post(self.get_body()).json()
+        response = self.post(self.get_body())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), first)
+        self.assertEqual(Ticket.objects.filter(is_sold=True).count(), 3)
+        self.assertEqual(self.post(self.get_body(first_quantity=1)).status_code, 422)
+
+    def test_nothing_is_sold_when_any_line_cannot_be_fulfilled(self):
+        response = self.post(self.get_body(first_quantity=3))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Ticket.objects.filter(is_sold=True).exists())
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.post(self.get_body(), key="key-1").status_code, 201)
+
+    def test_wrong_api_key_and_missing_idempotency_key(self):
+        self.assertEqual(self.post(self.get_body(), api_key="wrong").status_code, 401)
+        self.assertEqual(self.post(self.get_body(), key="").status_code, 400)
+
+    def test_line_with_wrong_category_type(self):
+        body = self.get_body()
+        body['lines'][0]['category'] = ["N"]
+        self.assertEqual(self.post(body).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_archive_box_office_order(self):
+        first = self.post(self.get_body()).json()
+        Event.objects.update(time_and_date=timezone.now() - timezone.timedelta(days=60))
+        call_command("archive_events", days=30, stdout=StringIO())
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ArchivedOrder.objects.get().id, first['order_id'])
+        self.assertIsNone(BoxOfficeRequest.objects.get(key="key-1").order)
+        self.assertEqual(self.post(self.get_body()).json(), first)
+
+
+class LotteryTest(TestCase):
+
+    def setUp(self):
+        self.test_event = Event.objects.create(
+            name="Lottery Event", time_and_date=timezone.now() + timezone.timedelta(days=7),
+            lottery_closes_at=timezone.now() + timezone.timedelta(hours=1),
+        )
+        for _ in range(4):
+            Ticket.objects.create(event=self.test_event, category=Ticket.CATEGORY[0][0])
+
+    def close_lottery(self):
+        Event.objects.filter(id=self.test_event.id).update(lottery_closes_at=timezone.now())
+
+    def test_entries_are_collected_instead_of_reservations(self):
+        self.client.get(f"/{self.test_event.id}/lottery/Normal?quantity=2")
+        self.client.get(f"/{self.test_event.id}/lottery/Normal?quantity=3")
+        self.client.get(f"/{self.test_event.id}/reserve/Normal")
+        entry = LotteryEntry.objects.get()
+        self.assertEqual((entry.quantity, entry.status), (2, LotteryEntry.PENDING))
+        self.assertEqual(entry.entrant, self.client.session.session_key)
+        self.assertFalse(Ticket.objects.filter(reservation_time__gt=timezone.now()).exists())
+        self.assertTrue("Enter lottery" in self.client.get(f"/{self.test_event.id}").content.decode())
+
+    def test_allocation_holds_tickets_of_winners(self):
+        for i in range(5):
+            LotteryEntry.objects.create(event=self.test_event, entrant=f"entrant{i}", category="N", quantity=2)
+        self.close_lottery()
+        out = StringIO()
+        call_command("allocate_lotteries", mode="random", seed=1, stdout=out)
+        self.assertIn("2 entries won, 3 lost", out.getvalue())
+        won = LotteryEntry.objects.filter(status=LotteryEntry.WON)
+        held_ids = sorted(ticket_id for entry in won for ticket_id in entry.ticket_ids)
+        self.assertEqual(held_ids, sorted(Ticket.objects.values_list('id', flat=True)))
+        self.assertEqual(Ticket.objects.filter(reservation_time__gt=timezone.now()).count(), 4)
+        self.assertTrue(Event.objects.get(id=self.test_event.id).lottery_allocated)
+
+    def test_won_tickets_are_claimed_into_basket(self):
+        self.client.get(f"/{self.test_event.id}/lottery/Normal?quantity=3")
+        self.close_lottery()
+        allocate_lottery(Event.objects.get(id=self.test_event.id))
+        self.client.get("/basket")
+        self.assertEqual(len(self.client.session[settings.BASKET_SESSION_ID]), 3)
+        self.assertEqual(LotteryEntry.objects.get().status, LotteryEntry.CLAIMED)
+        self.assertNotIn(LOTTERY_SESSION_FLAG, self.client.session)
+
+    def test_weighted_draw_prefers_heavier_entries(self):
+        first = [draw_order(np.array([1.0, 1000.0]), seed=seed)[0] for seed in range(20)]
+        self.assertGreater(first.count(1), 15)
+        self.assertRaises(ValueError, draw_order, [1.0, 0.0])
+        self.assertRaises(ValueError, draw_order, [1.0, -1.0])
+
+    @override_settings(BOX_OFFICE_API_KEYS=["secret"])
+    def test_box_office_refuses_pending_lottery(self):
+        body = {"name": "Box", "surname": "Office", "lines": [
+            {"event_id": self.test_event.id, "category": "N", "quantity": 1},
+        ]}
+        response = self.client.post(
+            "/api/box-office/purchase", json.dumps(body), content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer secret", HTTP_IDEMPOTENCY_KEY="key-1",
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Ticket.objects.filter(is_sold=True).exists())
+
+    def test_admin_refuses_to_sell_pending_lottery(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.client.post("/admin/main/ticket/", {
+            "action": "mark_sold", "_selected_action": list(Ticket.objects.values_list('id', flat=True)),
+        })
+        self.assertFalse(Ticket.objects.filter(is_sold=True).exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_entry_weight_is_inverse_of_quantity(self):
+        self.client.get(f"/{self.test_event.id}/lottery/Normal?quantity=4")
+        self.assertEqual(LotteryEntry.objects.get().weight, 0.25)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LotteryEntry.objects.create(event=self.test_event, entrant="entrant", category="N", weight=0)
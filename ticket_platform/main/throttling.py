@@ -0,0 +1,168 @@
+import math
+import time
+from collections import namedtuple
+from contextlib import suppress
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+RateLimit = namedtuple("RateLimit", ("capacity", "period"))
+
+DEFAULT_RATE_LIMITS = {
+    'reserve_ticket': RateLimit(capacity=30, period=60),
+    'release_ticket': RateLimit(capacity=30, period=60),
+}
+
+# Many clients could share one address (office, mobile network NAT), so IP limits are higher than session ones.
+DEFAULT_IP_RATE_LIMITS = {
+    'reserve_ticket': RateLimit(capacity=120, period=60),
+    'release_ticket': RateLimit(capacity=120, period=60),
+}
+
+
+def get_rate_limit(route, per_ip=False) -> RateLimit:
+    """
+    Get limit configured for given route. Limits of session could be overwritten by 'RATE_LIMITS' setting and limits
+    of IP address by 'IP_RATE_LIMITS' setting, where each route name is mapped to '(capacity, period)' pair.
+    :param route: name of throttled route, same as url name.
+    :param per_ip: get limit of IP address instead of session.
+    :return: RateLimit object or None if route is not throttled.
+    """
+    if per_ip:
+        limits = {**DEFAULT_IP_RATE_LIMITS, **getattr(settings, 'IP_RATE_LIMITS', {})}
+    else:
+        limits = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'RATE_LIMITS', {})}
+    limit = limits.get(route)
+    if limit is None:
+        return None
+    return RateLimit(*limit)
+
+
+def get_client_ip(request) -> str:
+    """
+    Get IP address of client. 'X-Forwarded-For' header is used only when 'RATE_LIMIT_TRUST_FORWARDED_FOR' is enabled,
+    because otherwise every client could pick his own key. The setting has to be enabled when app runs behind
+    a proxy, like Heroku router: 'REMOTE_ADDR' is address of the proxy then, so all clients would share one IP limit.
+    """
+    if getattr(settings, 'RATE_LIMIT_TRUST_FORWARDED_FOR', False):
+        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class SlidingWindow:
+    """
+    Sliding window counter with state stored in Django cache, so it is shared between all workers. Requests are
+    counted per fixed window of 'period' seconds with atomic 'add' and 'incr' (cache backend has to support them
+    atomically, like memcached or Redis), count of previous window is weighted by its part still within sliding
+    window. Up to 'capacity' requests are allowed per 'period' seconds.
+    """
+    def __init__(self, key, limit, cache=None) -> None:
+        self.key = key
+        self.limit = limit
+        self.cache = cache or caches[getattr(settings, 'RATE_LIMIT_CACHE', 'default')]
+
+    def _get_keys(self, now) -> tuple:
+        window = int(now // self.limit.period)
+        return f"{self.key}:{window - 1}", f"{self.key}:{window}"
+
+    def _get_wait(self, previous, current, tokens, now) -> float:
+        """
+        Get number of seconds after which tokens could be taken, 0 if they could be taken now.
+        :param previous: number of tokens taken within previous window.
+        :param current: number of tokens taken within current window.
+        """
+        capacity, period = self.limit
+        elapsed = now % period
+        if current + tokens > capacity:
+            return period - elapsed
+        if previous * (1 - elapsed / period) + current + tokens <= capacity:
+            return 0
+        return (1 - (capacity - tokens - current) / previous) * period - elapsed
+
+    def check(self, tokens=1, now=None) -> float:
+        """
+        Check if tokens could be taken, without taking them.
+        :return: 0 if tokens could be taken, otherwise number of seconds after which request could be repeated.
+        """
+        now = time.time() if now is None else now
+        previous_key, current_key = self._get_keys(now)
+        counts = self.cache.get_many([previous_key, current_key])
+        return self._get_wait(counts.get(previous_key, 0), counts.get(current_key, 0), tokens, now)
+
+    def consume(self, tokens=1, now=None) -> float:
+        """
+        Try to take tokens. Counter is increased atomically, so concurrent requests never take more than limit;
+        tokens are given back when limit is exceeded.
+        :param tokens: number of tokens needed by request.
+        :return: 0 if tokens were taken, otherwise number of seconds after which request could be repeated.
+        """
+        now = time.time() if now is None else now
+        previous_key, current_key = self._get_keys(now)
+        self.cache.add(current_key, 0, timeout=math.ceil(self.limit.period * 2))
+        current = self.cache.incr(current_key, tokens)
+        wait = self._get_wait(self.cache.get(previous_key, 0), current - tokens, tokens, now)
+        if wait:
+            self.release(tokens, now)
+        return wait
+
+    def release(self, tokens=1, now=None) -> None:
+        """
+        Give back tokens taken by 'consume' with the same time.
+        """
+        _, current_key = self._get_keys(time.time() if now is None else now)
+        with suppress(ValueError):
+            self.cache.decr(current_key, tokens)
+
+
+def throttle(request, route) -> float:
+    """
+    Take a token from the session and IP windows for given route, each with its own limit. All windows are checked
+    before any token is taken, and tokens already taken are given back if any window is exceeded meanwhile, so
+    rejected request doesn't use limit of other windows.
+    :return: 0 if request is allowed, otherwise number of seconds to wait.
+    """
+    windows = []
+    ip_limit = get_rate_limit(route, per_ip=True)
+    if ip_limit is not None:
+        windows.append(SlidingWindow(f"throttle:{route}:ip:{get_client_ip(request)}", ip_limit))
+    session_limit = get_rate_limit(route)
+    session_key = getattr(request.session, 'session_key', None)
+    if session_limit is not None and session_key:
+        windows.append(SlidingWindow(f"throttle:{route}:session:{session_key}", session_limit))
+    if not windows:
+        return 0
+    now = time.time()
+    retry_after = max(window.check(now=now) for window in windows)
+    if retry_after:
+        return retry_after
+    consumed = []
+    for window in windows:
+        retry_after = window.consume(now=now)
+        if retry_after:
+            for consumed_window in consumed:
+                consumed_window.release(now=now)
+            return retry_after
+        consumed.append(window)
+    return 0
+
+
+def rate_limit(route):
+    """
+    View decorator, which respond with '429 Too Many Requests' when client exceed limit for given route.
+    :param route: name of throttled route, used to find its limit and to build bucket keys.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped_view(request, *args, **kwargs):
+            retry_after = throttle(request, route)
+            if retry_after:
+                response = HttpResponse("Too many requests. Please, try again later.", status=429)
+                response['Retry-After'] = str(math.ceil(retry_after))
+                return response
+            return view(request, *args, **kwargs)
+        return wrapped_view
+    return decorator
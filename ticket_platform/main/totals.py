@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import connections, router
+
+from .models import Ticket
+from .sharding import get_ticket_databases
+
+
+def estimate_row_count(model, using=None):
+    """
+    Get number of rows in model table estimated by PostgreSQL planner statistics, without scanning the table.
+    :param model: model class.
+    :param using: database alias, database chosen by routers by default.
+    :return: estimated number of rows, or None if estimation isn't available (other database or table not analyzed).
+    """
+    connection = connections[using or router.db_for_read(model)]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def get_total_num_of_tickets(totals) -> int:
+    """
+    Get total number of tickets. If 'STATS_APPROXIMATE_COUNTS' setting is enabled, number of tickets in main table is
+    taken from planner statistics of every shard.
+    :param totals: PlatformTotals object.
+    :return: number of tickets, including archived ones.
+    """
+    if getattr(settings, 'STATS_APPROXIMATE_COUNTS', False):
+        estimates = [estimate_row_count(Ticket, using=database) for database in get_ticket_databases()]
+        if None not in estimates:
+            return sum(estimates) + totals.archived_tickets
+    return totals.tickets
@@ -17,14 +17,19 @@ Including another URLconf
 from django.urls import path
 
 from .views import event_list_view, event_detail_view, reserve_ticket_for_event, basket_view, \
-    release_ticket_from_basket, stats, buy_tickets
+    release_ticket_from_basket, stats, buy_tickets, export_sales, reserve_seats_for_event, box_office_purchase, \
+    enter_lottery_for_event
 
 urlpatterns = [
     path('', event_list_view, name='main'),
     path('stats', stats, name='stats'),
+    path('export/sales.<export_format>', export_sales, name='export_sales'),
+    path('api/box-office/purchase', box_office_purchase, name='box_office_purchase'),
     path('basket', basket_view, name='basket_view'),
     path('basket/buy', buy_tickets, name='buy_tickets'),
     path('basket/release/<event_id>/<category>', release_ticket_from_basket, name='release_ticket'),
     path('<event_id>', event_detail_view, name='event_detail'),
     path('<event_id>/reserve/<category>', reserve_ticket_for_event, name='reserve_ticket'),
+    path('<event_id>/reserve/<category>/seats', reserve_seats_for_event, name='reserve_seats'),
+    path('<event_id>/lottery/<category>', enter_lottery_for_event, name='enter_lottery'),
 ]
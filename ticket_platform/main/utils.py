@@ -1,7 +1,7 @@
 import datetime
 from collections import namedtuple
 
-EventAndTickets = namedtuple("EventAndTickets", ("event", "num_of_tickets"))
+EventAndTickets = namedtuple("EventAndTickets", ("event", "num_of_tickets", "inventory_version"))
 EventSummary = namedtuple("EventSummary", ("event", "total_tickets", "reservations", "sold_tickets", "profit", "possible_profit"))
 
 
@@ -23,6 +23,18 @@ def turn_none_into_zero(value):
     return value
 
 
+def add_archived(value, archived_value):
+    """
+    Add archived part to value calculated from main tables.
+    :param value: value calculated from main tables, could be 'None' if there was nothing to aggregate.
+    :param archived_value: value taken from archive summary, 'None' if nothing was archived.
+    :return: sum of both values or value untouched if nothing was archived.
+    """
+    if not archived_value:
+        return value
+    return turn_none_into_zero(value) + archived_value
+
+
 def time_between(start, end):
     """
     Get all days between start and end date. Needed to generate a full chart from first object occurence to last.
@@ -33,3 +45,69 @@ def time_between(start, end):
     while start < end:
         yield start
         start += datetime.timedelta(days=1)
+
+
+def bucket_start(day, resolution) -> datetime.date:
+    """
+    Get the first day of chart bucket containing given day.
+    :param day: date in datetime.date format.
+    :param resolution: 'day', 'week' (starting on Monday) or 'month'.
+    :return: first day of bucket.
+    """
+    if resolution == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if resolution == "month":
+        return day.replace(day=1)
+    return day
+
+
+def buckets_between(start, end, resolution):
+    """
+    Get first days of all chart buckets between start and end date, both included.
+    :param start: start date in datetime.date format.
+    :param end: end date in datetime.date format.
+    :param resolution: 'day', 'week' or 'month'.
+    :return: yield first day of every bucket.
+    """
+    bucket = bucket_start(start, resolution)
+    while bucket <= end:
+        yield bucket
+        if resolution == "week":
+            bucket += datetime.timedelta(days=7)
+        elif resolution == "month":
+            bucket = (bucket + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            bucket += datetime.timedelta(days=1)
+
+
+def downsample_lttb(x, y, threshold) -> tuple:
+    """
+    Reduce number of chart points with Largest Triangle Three Buckets algorithm. First and last points are kept,
+    from every bucket between them the point forming the largest triangle with its neighbours is taken, so peaks
+    and drops remain visible.
+    :param x: list with x values.
+    :param y: list with y values.
+    :param threshold: maximal number of points.
+    :return: tuple with downsampled x and y lists.
+    """
+    if threshold < 3 or len(y) <= threshold:
+        return list(x), list(y)
+    values = [float(value) for value in y]
+    bucket_size = (len(values) - 2) / (threshold - 2)
+    selected = [0]
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(values))
+        if next_end > end:
+            average_x = (end + next_end - 1) / 2
+            average_y = sum(values[end:next_end]) / (next_end - end)
+        else:
+            average_x, average_y = len(values) - 1, values[-1]
+        previous = selected[-1]
+        selected.append(max(range(start, end), key=lambda index: abs(
+            (previous - average_x) * (values[index] - values[previous])
+            - (previous - index) * (average_y - values[previous])
+        )))
+    selected.append(len(values) - 1)
+    return [x[index] for index in selected], [y[index] for index in selected]
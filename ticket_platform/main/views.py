@@ -1,38 +1,75 @@
+import hmac
+import json
+from functools import partial
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Sum
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 from django.utils.html import mark_safe
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from .basket import Basket
-from .forms import PaymentForm
-from .line_chart_plotter import OrderPlotter
-from .models import Event, Ticket
-from .utils import EventAndTickets, payment_error_message, EventSummary
-from .models import Order
+from .box_office import purchase
+from .exceptions import BoxOfficeError, PaymentAmountMismatch
+from .exports import EXPORT_FORMATS, get_sold_tickets
+from .forms import PaymentForm, EventSearchForm, SalesChartForm
+from .fragment_cache import get_inventory_versions
+from .lottery import claim_lottery_wins, enter_lottery
+from .models import Event, Ticket, PlatformTotals, DailySales
+from .routers import replica_reads
+from .search import search_events
+from .seating import allocate_seats
+from .throttling import rate_limit
+from .totals import get_total_num_of_tickets
+from .utils import EventAndTickets, payment_error_message, EventSummary, add_archived
+
+
+def get_event_summary(event) -> EventSummary:
+    """
+    Gather stats of single event, including totals of its archived tickets.
+    :param event: Event object, preferably with selected 'archive_summary'.
+    :return: EventSummary object.
+    """
+    archived = getattr(event, 'archive_summary', None)
+    return EventSummary(
+        event=event,
+        total_tickets=add_archived(event.ticket_set.all().count(), archived and archived.total_tickets),
+        reservations=event.reservations,
+        sold_tickets=add_archived(
+            event.ticket_set.filter(is_sold=True).count(), archived and archived.sold_tickets
+        ),
+        profit=add_archived(
+            event.ticket_set.filter(is_sold=True).aggregate(Sum('price'))['price__sum'], archived and archived.profit
+        ),
+        possible_profit=add_archived(
+            event.ticket_set.all().aggregate(Sum('price'))['price__sum'], archived and archived.possible_profit
+        ),
+    )
 
 
+@replica_reads()
 def stats(request):
     """
-    Generate a several stats about tickets, event and incomes.
+    Generate a several stats about tickets, event and incomes. Totals include archived tickets and are taken from
+    maintained PlatformTotals row instead of scanning tickets. Charts could be limited to date window and resolution
+    given in query parameters.
     """
-    total_num_of_events = Event.objects.all().count()
-    total_num_of_tickets = Ticket.objects.all().count()
+    totals = PlatformTotals.get()
+    total_num_of_events = totals.events
+    total_num_of_tickets = get_total_num_of_tickets(totals)
     total_reservations = Event.objects.all().aggregate(Sum('reservations'))['reservations__sum']
-    total_sold_tickets = Ticket.objects.filter(is_sold=True).count()
-    total_profit = Ticket.objects.filter(is_sold=True).aggregate(Sum('price'))['price__sum']
-    total_possible_profit = Ticket.objects.all().aggregate(Sum('price'))['price__sum']
+    total_sold_tickets = totals.sold_tickets
+    total_profit = totals.profit
+    total_possible_profit = totals.possible_profit
 
     if not total_num_of_events:
         context = {'total_num_of_events': total_num_of_events}
     else:
-        events_summary = (EventSummary(
-            event=e,
-            total_tickets=e.ticket_set.all().count(),
-            reservations=e.reservations,
-            sold_tickets=e.ticket_set.filter(is_sold=True).count(),
-            profit=e.ticket_set.filter(is_sold=True).aggregate(Sum('price'))['price__sum'],
-            possible_profit=e.ticket_set.all().aggregate(Sum('price'))['price__sum'])
-            for e in Event.objects.all())
+        events_summary = (get_event_summary(e) for e in Event.objects.select_related('archive_summary'))
 
         context = {
             'total_num_of_events': total_num_of_events,
@@ -44,20 +81,74 @@ def stats(request):
             'events_summary': events_summary,
         }
 
-    if Order.objects.count():
-        op = OrderPlotter()
+    if DailySales.objects.exists():
+        # Charting stack (plotly) is heavy, so it is imported only when chart is really drawn.
+        from .line_chart_plotter import OrderPlotter
+        chart_form = SalesChartForm(request.GET)
+        chart_options = chart_form.cleaned_data if chart_form.is_valid() else {}
+        op = OrderPlotter(
+            date_from=chart_options.get('date_from'),
+            date_to=chart_options.get('date_to'),
+            resolution=chart_options.get('resolution') or "auto",
+        )
         orders_per_day = op.get_chart_with_number_of_orders_per_day()
         profits_per_day = op.get_chart_with_profits_per_day()
         context['orders_per_day'] = mark_safe(orders_per_day)
         context['profits_per_day'] = mark_safe(profits_per_day)
+        context['chart_form'] = chart_form
 
     return render(request, 'main/stats.html', context)
 
 
+@staff_member_required
+def export_sales(request, export_format) -> StreamingHttpResponse:
+    """
+    Stream all sold tickets with their orders as CSV or JSON lines file.
+    :param export_format: 'csv' or 'jsonl'.
+    :return: streaming response with export file.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+    iter_export, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(iter_export(get_sold_tickets()), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="sales.{export_format}"'
+    return response
+
+
+@csrf_exempt
+@require_POST
+def box_office_purchase(request) -> JsonResponse:
+    """
+    JSON API for box office and resellers. Request body contains buyer 'name', 'surname' and list of 'lines' with
+    'event_id', 'category' and 'quantity'. Client is authorized by 'Authorization: Bearer <key>' header with one of
+    'BOX_OFFICE_API_KEYS' and has to send 'Idempotency-Key' header, so repeated request doesn't buy tickets twice.
+    :return: JSON response with order id and ids of sold tickets, or with error message.
+    """
+    authorization = request.headers.get('Authorization', '')
+    if not any(
+        hmac.compare_digest(authorization, f"Bearer {api_key}")
+        for api_key in getattr(settings, 'BOX_OFFICE_API_KEYS', [])
+    ):
+        return JsonResponse({'error': "Wrong API key."}, status=401)
+    key = request.headers.get('Idempotency-Key', '')
+    if not key or len(key) > 64:
+        return JsonResponse({'error': "Idempotency-Key header with up to 64 characters is required."}, status=400)
+    try:
+        data = json.loads(request.body)
+        name, surname, lines = str(data['name'])[:30], str(data['surname'])[:30], data['lines']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "Request body has to be JSON object with name, surname and lines."}, status=400)
+    try:
+        response, created = purchase(key, name, surname, lines)
+    except BoxOfficeError as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+    return JsonResponse(response, status=201 if created else 200)
+
+
 def buy_tickets(request) -> render:
     """
     View with all reserved tickets and semi-payment gateway. In case of lack any reserved ticket, user will get
-    suitable message.
+    suitable message. Paid amount is checked against ticket prices within purchase transaction.
     :return: render object with buy form and basket.
     """
     payment_error = None
@@ -70,48 +161,52 @@ def buy_tickets(request) -> render:
             currency = cd['currency']
             name = cd['name']
             surname = cd['surname']
-            if amount == basket.get_total_price():
-                basket.buy(name, surname)
-            else:
+            try:
+                basket.buy(name, surname, amount=amount)
+            except PaymentAmountMismatch:
                 payment_error = payment_error_message(currency, amount)
     else:
         form = PaymentForm()
     return render(request, "main/basket/buy.html", {'form': form, 'payment_error': payment_error})
 
 
+@rate_limit('release_ticket')
 def release_ticket_from_basket(request, event_id, category) -> redirect:
     """
     Redirected view needed to release ticket data for others users.
     :param event_id: id of tickets event.
-    :param category: user select from which category want release ticket.
+    :param category: user select from which category (label) want release ticket.
     :return: redirect object with basket view (updated by released ticket)
     """
     basket = Basket(request)
-    basket.remove(event_id, category)
+    basket.remove(event_id, Ticket.CATEGORY_CODES.get(category))
     return redirect('basket_view')
 
 
 def basket_view(request):
     """
-    View with the data from the session basket.
+    View with the data from the session basket. Tickets won in lottery are added to basket first.
     :return: render template with data from basket and rendered request.'.
     """
+    claim_lottery_wins(request)
     return render(request, "main/basket/list.html")
 
 
+@rate_limit('reserve_ticket')
 def reserve_ticket_for_event(request, event_id, category) -> redirect:
     """
     Function to launch 'reserve_ticket' method for last ticket in given category for given event.
     :param event_id: event for given ticket.
-    :param category: category of ticket (from Normal, Premium and VIP).
+    :param category: category label of ticket (from Normal, Premium and VIP).
     :return: redirect object to 'event_detail_view'.
     """
     basket = Basket(request)
     event_id = int(event_id)
     event = get_object_or_404(Event, id=event_id)
-    last_ticket = Ticket.objects.filter(
-        category=category,
-        event=event
+    if event.is_lottery_pending():
+        return redirect('event_detail', event_id)
+    last_ticket = event.ticket_set.filter(
+        category=Ticket.CATEGORY_CODES.get(category),
     ).exclude(
         reservation_time__gte=timezone.now()
     ).last()
@@ -119,22 +214,106 @@ def reserve_ticket_for_event(request, event_id, category) -> redirect:
     return redirect('event_detail', event_id)
 
 
+@rate_limit('reserve_ticket')
+def reserve_seats_for_event(request, event_id, category) -> redirect:
+    """
+    Reserve the best block of seats next to each other, in given category for given event. Number of seats is taken
+    from 'quantity' parameter.
+    :param event_id: event for given tickets.
+    :param category: category label of tickets (from Normal, Premium and VIP).
+    :return: redirect object to 'event_detail_view' or detail page with error if there is no such block of seats.
+    """
+    event = get_object_or_404(Event, id=int(event_id))
+    if event.is_lottery_pending():
+        return redirect('event_detail', event.id)
+    try:
+        quantity = int(request.GET.get('quantity', 1))
+    except ValueError:
+        quantity = 0
+    ticket_ids = allocate_seats(event.id, Ticket.CATEGORY_CODES.get(category), quantity)
+    if not ticket_ids:
+        context = get_event_detail_context(event)
+        context['seats_error'] = f"There are no {quantity} free seats next to each other in {category} category."
+        return render(request, "main/event/detail.html", context)
+    event.increase_reservations_counter()
+    Basket(request).add_held_tickets(ticket_ids)
+    return redirect('event_detail', event.id)
+
+
+@rate_limit('reserve_ticket')
+def enter_lottery_for_event(request, event_id, category) -> redirect:
+    """
+    Enter lottery of event for tickets in given category. Number of tickets is taken from 'quantity' parameter.
+    :param event_id: lottery event.
+    :param category: category label of tickets (from Normal, Premium and VIP).
+    :return: redirect object to 'event_detail_view'.
+    """
+    event = get_object_or_404(Event, id=int(event_id))
+    try:
+        quantity = int(request.GET.get('quantity', 1))
+    except ValueError:
+        quantity = 0
+    enter_lottery(request, event, Ticket.CATEGORY_CODES.get(category), quantity)
+    return redirect('event_detail', event.id)
+
+
+def get_event_detail_context(event) -> dict:
+    """
+    Gather data about single event needed by detail template.
+    """
+    return {
+        "event": event,
+        "tickets": event.get_available_tickets_num_by_categories(),
+        "has_seats": event.ticket_set.filter(seat__isnull=False).exists(),
+        "lottery_open": event.is_lottery_open(),
+        "lottery_pending": event.is_lottery_pending(),
+    }
+
+
+@replica_reads()
 def event_detail_view(request, event_id) -> render:
     """
     Main view for single event.
     """
     event_id = int(event_id)
     event = get_object_or_404(Event, id=event_id)
-    return render(request, "main/event/detail.html", {
-        "event": event,
-        "tickets": event.get_available_tickets_num_by_categories(),
-    })
+    claim_lottery_wins(request)
+    return render(request, "main/event/detail.html", get_event_detail_context(event))
 
 
+@replica_reads()
 def event_list_view(request) -> render:
     """
-    Main view for all events in database, sorted by time.
+    Main view for future events, sorted by time, filtered by name, date range and availability given in query
+    parameters. Events are shown in pages of 'EVENTS_PER_PAGE' size. One more event than needed is fetched to find
+    out if next page exists, so the whole filtered table is never counted. Number of available tickets is passed
+    as method, so it is counted only for event cards missing in cache. Invalid filters are shown with errors, other
+    filters are still applied.
     """
-    events = Event.objects.order_by('-time_and_date').exclude(time_and_date__lte=timezone.now())
-    events_with_tickets = [EventAndTickets(e, e.get_sum_of_available_tickets()) for e in events]
-    return render(request, "main/event/list.html", {"events": events_with_tickets})
+    form = EventSearchForm(request.GET)
+    form.is_valid()
+    search = form.cleaned_data
+    per_page = getattr(settings, 'EVENTS_PER_PAGE', 50)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * per_page
+    events = list(search_events(**search)[offset:offset + per_page + 1])
+    has_next = len(events) > per_page
+    events = events[:per_page]
+    versions = get_inventory_versions([e.id for e in events])
+    # Event card is cached for new inventory version, so it is rendered with live count instead of snapshot, which
+    # could be older than change that created the version.
+    events_with_tickets = [
+        EventAndTickets(e, partial(e.get_sum_of_available_tickets, use_snapshot=False), versions[e.id]) for e in events
+    ]
+    query = request.GET.copy()
+    query.pop('page', None)
+    return render(request, "main/event/list.html", {
+        "events": events_with_tickets,
+        "form": form,
+        "query": query.urlencode(),
+        "previous_page": page - 1 if page > 1 else None,
+        "next_page": page + 1 if has_next else None,
+    })